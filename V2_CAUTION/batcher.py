@@ -0,0 +1,134 @@
+"""Micro-batching of RECORDID lookups into a single mainframe job.
+
+Select requests that arrive within WINDOW seconds of each other are merged:
+one job is submitted for the union of their record ids and the returned rows
+are handed back to each request, filtered to the ids it asked for. If the
+rows came back but can't be matched to ids, each request is rerun as its own
+job instead; a failed job (None) fails every request in the batch.
+"""
+import asyncio
+import contextlib
+import json
+import time
+
+WINDOW = 0.25
+MAX_IDS = 200
+# Field names the COBOL programs have used for the record id column
+KEY_FIELDS = ("record_id", "RECORDID", "recordid")
+
+
+def record_key(row):
+    if isinstance(row, dict):
+        for field in KEY_FIELDS:
+            if field in row:
+                return str(row[field]).strip()
+    return None
+
+
+class MicroBatcher:
+    def __init__(self, fn, window=WINDOW, max_ids=MAX_IDS, key=record_key, gate=None):
+        """fn(ids) -> JSON string of rows (or None on failure), blocking.
+
+        gate() -> async context manager held around each fn call (a scheduler slot).
+        """
+        self.fn = fn
+        self.gate = gate or contextlib.nullcontext
+        self.window = window
+        self.max_ids = max_ids
+        self.key = key
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._stats = {
+            "batches": 0, "requests": 0, "ids": 0,
+            "max_batch": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0,
+            "rerun": 0,
+        }
+
+    async def submit(self, ids):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((list(ids), fut, time.monotonic()))
+        if sum(len(p[0]) for p in self._pending) >= self.max_ids:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            t = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(t)
+            t.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        started = time.monotonic()
+        union = sorted({i for ids, _, _ in batch for i in ids})
+        self._record(batch, union, started)
+        try:
+            async with self.gate():
+                json_data = await asyncio.to_thread(self.fn, union)
+            rows = None if json_data is None else json.loads(json_data)
+        except Exception as e:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self._stats["run_total"] += time.monotonic() - started
+
+        # None is a failed job (zowe error, timeout): every waiter gets the failure.
+        # Rerunning one job per request would only multiply it against the mainframe.
+        if rows is not None and len(batch) > 1 and not self._attributable(rows):
+            # Handing everyone the union would leak (and cache) other callers' rows
+            self._stats["rerun"] += 1
+            await asyncio.gather(*(self._run([request]) for request in batch))
+            return
+        for ids, fut, _ in batch:
+            if not fut.done():
+                fut.set_result(self._slice(rows, ids))
+
+    def _attributable(self, rows):
+        """Whether rows can be split between requests by record id."""
+        return isinstance(rows, list) and (
+            not rows or any(self.key(r) is not None for r in rows))
+
+    def _slice(self, rows, ids):
+        if not self._attributable(rows):
+            # Only for a request that had the job to itself
+            return rows
+        wanted = {str(i).strip() for i in ids}
+        return [r for r in rows if self.key(r) in wanted]
+
+    def _record(self, batch, union, started):
+        s = self._stats
+        s["batches"] += 1
+        s["requests"] += len(batch)
+        s["ids"] += len(union)
+        s["max_batch"] = max(s["max_batch"], len(batch))
+        for _, _, queued in batch:
+            wait = started - queued
+            s["wait_total"] += wait
+            s["wait_max"] = max(s["wait_max"], wait)
+
+    def stats(self):
+        s = self._stats
+        batches = s["batches"] or 1
+        requests = s["requests"] or 1
+        return {
+            "window": self.window,
+            "batches": s["batches"],
+            "requests": s["requests"],
+            "avg_batch_requests": round(s["requests"] / batches, 2),
+            "avg_batch_ids": round(s["ids"] / batches, 2),
+            "max_batch_requests": s["max_batch"],
+            "avg_wait": round(s["wait_total"] / requests, 4),
+            "max_wait": round(s["wait_max"], 4),
+            "avg_job_time": round(s["run_total"] / batches, 3),
+            "rerun_batches": s["rerun"],
+            "pending": len(self._pending),
+        }
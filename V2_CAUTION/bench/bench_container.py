@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Compare a cold `distrobox enter` against the pooled container agent.
+
+Run on the host from the backup_service directory:
+
+    python3 bench/bench_container.py            # 20 runs of `true`
+    python3 bench/bench_container.py -n 50 -- nvidia-smi -L
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import container  # noqa: E402
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<10} n={len(samples):<4} mean={statistics.mean(samples) * 1000:9.1f} ms"
+          f"  p50={statistics.median(samples) * 1000:9.1f} ms  p95={p95 * 1000:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=20, help="runs per path")
+    parser.add_argument("argv", nargs="*", default=["true"])
+    args = parser.parse_args()
+
+    print(f"command: {' '.join(args.argv)}")
+    t0 = time.perf_counter()
+    if not container.ensure_agent():
+        sys.exit("container agent did not start; see container_agent.log")
+    print(f"agent ready in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    cold = timed(lambda: subprocess.run(container.cold_cmd(*args.argv), capture_output=True), args.n)
+    pooled = timed(lambda: container.run(args.argv), args.n)
+
+    report("cold", cold)
+    report("pooled", pooled)
+    print(f"speedup    {statistics.median(cold) / statistics.median(pooled):.1f}x (p50)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""OCR pipeline throughput against a stub ollama server.
+
+The stub answers /api/version and /api/generate like ollama, taking --latency
+seconds per image with --server-parallel requests served at once (like
+OLLAMA_NUM_PARALLEL on the GPU). ocr_images.run() is timed at each client
+concurrency and the .md files are checked against what the stub returned.
+
+    python3 bench/bench_ocr.py
+    python3 bench/bench_ocr.py -n 100 --latency 0.5 --server-parallel 4 -j 1 2 4 8
+"""
+import argparse
+import base64
+import hashlib
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import ocr_images  # noqa: E402
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real server
+    disable_nagle_algorithm = True
+    latency = 0.2
+    slots = threading.Semaphore(2)
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self.reply(200, {"version": "0.0.0-stub"})
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).connections.add(self.client_address)
+        if self.path != "/api/generate" or not body.get("images"):
+            self.reply(400, {"error": "bad request"})
+            return
+        with self.slots:
+            time.sleep(self.latency)
+        digest = hashlib.sha256(base64.b64decode(body["images"][0])).hexdigest()[:16]
+        self.reply(200, {"model": body["model"], "response": f"# text {digest}\n", "done": True})
+
+
+def start_stub(latency, parallel):
+    StubOllama.latency = latency
+    StubOllama.slots = threading.Semaphore(parallel)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_images(folder, count, size):
+    for i in range(count):
+        (folder / f"img{i:04d}.png").write_bytes(i.to_bytes(4, "big") * (size // 4))
+
+
+def check_outputs(folder):
+    bad = 0
+    for img in ocr_images.find_images(folder):
+        digest = hashlib.sha256(img.read_bytes()).hexdigest()[:16]
+        md = img.with_suffix(".md")
+        bad += not md.exists() or md.read_text().strip() != f"# text {digest}"
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--images", type=int, default=40)
+    parser.add_argument("--size", type=int, default=200_000, help="bytes per fake image")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds per image")
+    parser.add_argument("--server-parallel", type=int, default=2)
+    parser.add_argument("-j", "--concurrency", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    server = start_stub(args.latency, args.server_parallel)
+    host = f"127.0.0.1:{server.server_address[1]}"
+    print(f"stub ollama {host}: {args.latency}s/image, {args.server_parallel} parallel")
+    print(f"{'concurrency':>12}{'images':>8}{'errors':>8}{'seconds':>10}{'images/s':>10}{'conns':>7}{'bad .md':>9}")
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            make_images(folder, args.images, args.size)
+            pool = ocr_images.OllamaPool(host)
+            StubOllama.connections = set()
+            summary = ocr_images.run(ocr_images.find_images(folder), pool,
+                                     concurrency=concurrency)
+            pool.close()
+            print(f"{concurrency:>12}{summary['processed']:>8}{summary['errors']:>8}"
+                  f"{summary['seconds']:>10}{summary['images_per_s']:>10}"
+                  f"{len(StubOllama.connections):>7}{check_outputs(folder):>9}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
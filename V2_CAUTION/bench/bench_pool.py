@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Spawn latency of a host script: `uv run` vs `python3 script.py` vs the script pool.
+
+A stand-in task (one `true` subprocess call and a print, like the host scripts
+minus their real work) is run N times each way. The table shows the time from
+launch to exit. "pool, to pid" is what the job engine waits before a pooled run
+is started.
+
+    python3 bench/bench_pool.py
+    python3 bench/bench_pool.py -n 100
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import script_pool  # noqa: E402
+
+TASK = '''import subprocess
+def main():
+    subprocess.run(["true"])
+    print("bench task done")
+    return True
+if __name__ == "__main__":
+    main()
+'''
+
+SHIM = '''import sys
+from pathlib import Path
+sys.path.insert(0, {src!r})
+sys.path.insert(0, {root!r})
+import script_pool
+script_pool.SOCKET_PATH = Path({sock!r})
+script_pool.TASKS = ("bench_task",)
+script_pool.serve()
+'''
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return samples
+
+
+def row(name, samples):
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000  # noqa: E731
+    print(f"{name:<22}{p(0.5):>10.1f}{p(0.95):>10.1f}{min(samples) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="script_pool_bench_"))
+    task = root / "bench_task.py"
+    task.write_text(TASK)
+    (root / "pool_shim.py").write_text(SHIM.format(
+        src=str(HERE.parent), root=str(root), sock=str(root / "pool.sock")))
+    script_pool.BASE_DIR = root
+    script_pool.SOCKET_PATH = root / "pool.sock"
+    script_pool.POOL_SCRIPT = root / "pool_shim.py"
+    script_pool.POOL_LOG = root / "pool.log"
+    script_pool.TASKS = ("bench_task",)
+
+    t0 = time.perf_counter()
+    if not script_pool.ensure_pool():
+        sys.exit(f"pool did not start, see {script_pool.POOL_LOG}")
+    print(f"pool server started in {(time.perf_counter() - t0) * 1000:.0f} ms (one-off)\n")
+
+    def pooled():
+        r = script_pool.run("bench_task")
+        assert r.returncode == 0 and "bench task done" in r.stdout, r
+
+    async def to_pid():
+        p = await script_pool.spawn("bench_task")
+        elapsed = time.perf_counter()
+        await p.stdout.read()
+        await p.wait()
+        return elapsed
+
+    def pooled_spawn():
+        t0 = time.perf_counter()
+        return asyncio.run(to_pid()) - t0
+
+    print(f"{'method':<22}{'p50 ms':>10}{'p95 ms':>10}{'min ms':>10}")
+    uv = shutil.which("uv")
+    if uv:
+        row("uv run", timed(lambda: subprocess.run([uv, "run", "--no-project", str(task)],
+                                                   capture_output=True, check=True), args.runs))
+    else:
+        print(f"{'uv run':<22}{'(uv not on PATH)':>30}")
+    row("python3 script.py", timed(lambda: subprocess.run([sys.executable, str(task)],
+                                                          capture_output=True, check=True), args.runs))
+    row("pool, to exit", timed(pooled, args.runs))
+    row("pool, to pid", sorted(pooled_spawn() for _ in range(args.runs)))
+
+    os.kill(script_pool.ping()["pong"], signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    main()
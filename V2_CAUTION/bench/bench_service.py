@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""Offline load benchmark for the FastAPI service.
+
+distrobox, zowe, restic, rpm-ostree, gpg, ollama, uv, systemctl and nvidia-smi
+are replaced by fake executables on PATH with configurable latency and output
+size, so this runs on any Linux box with no network, container or mainframe.
+kleopatra, nvidia_fix and ostree_upgrade are fake modules of the same shape,
+run by a script pool started in the sandbox. The app is served by uvicorn in-process and driven with concurrent keep-alive
+clients; per endpoint it reports p50/p99 latency and throughput, then job
+engine throughput, peak server threads and the memory high-water mark.
+
+Run from the backup_service directory (missouri_query.py must be importable):
+
+    python3 bench/bench_service.py
+    python3 bench/bench_service.py -c 32 -n 400 --latency 0.2 --bytes 1000000
+    python3 bench/bench_service.py --json before.json      # keep for comparison
+
+Per-tool overrides: FAKE_<TOOL>_LATENCY / FAKE_<TOOL>_BYTES / FAKE_<TOOL>_EXIT,
+e.g. FAKE_ZOWE_LATENCY=3 FAKE_ZOWE_ROWS=5000.
+"""
+import argparse
+import http.client
+import json
+import os
+import resource
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+# kleopatra.py (imported by health.py) is deployed beside the service but lives at the repo root
+sys.path.append(str(HERE.parent.parent))
+
+FAKE_TOOLS = ["distrobox", "zowe", "restic", "rpm-ostree", "gpg", "ollama",
+              "uv", "systemctl", "nvidia-smi"]
+
+FAKE_TOOL = '''#!{python}
+import os, sys, time
+name = os.path.basename(sys.argv[0])
+def env(key, default):
+    tool = "FAKE_" + name.upper().replace("-", "_") + "_" + key
+    return os.environ.get(tool, os.environ.get("FAKE_" + key, default))
+time.sleep(float(env("LATENCY", "0.05")))
+if name == "distrobox" and "--" in sys.argv:
+    # "enter the container": run the rest on the host after the entry cost
+    argv = sys.argv[sys.argv.index("--") + 1:]
+    os.execvp(argv[0], argv)
+if name == "zowe":
+    print("Spool file: JESMSGLG (ID #2, Step: JES2)")
+    print("Spool file: PIPEOUT (ID #104, Step: STEP1)")
+    for i in range(int(env("ROWS", "200"))):
+        print(f"{{i:08d}}|1000.00|{{i}}.50|SURNAME{{i}}|FIRST{{i}}|comment")
+    print("Spool file: SYSTSPRT (ID #105)")
+    sys.exit(0)
+remaining = int(env("BYTES", "4096"))
+line = (name + " output " + "x" * 70 + "\\n").encode()
+out = sys.stdout.buffer
+while remaining > 0:
+    out.write(line[:remaining])
+    remaining -= len(line)
+out.flush()
+sys.exit(int(env("EXIT", "0")))
+'''
+
+AGENT_SHIM = '''import asyncio, sys
+from pathlib import Path
+sys.path.insert(0, {src!r})
+import container_agent
+container_agent.SOCKET_PATH = Path({sock!r})
+asyncio.run(container_agent.main())
+'''
+
+# Stands in for kleopatra.py / nvidia_fix.py / ostree_upgrade.py in the script pool
+FAKE_SCRIPT = '''import os, sys, time
+def env(key, default):
+    return os.environ.get("FAKE_{upper}_" + key, os.environ.get("FAKE_" + key, default))
+def main():
+    time.sleep(float(env("LATENCY", "0.05")))
+    remaining = int(env("BYTES", "4096"))
+    line = ("{name} output " + "x" * 70 + "\\n").encode()
+    while remaining > 0:
+        sys.stdout.buffer.write(line[:remaining])
+        remaining -= len(line)
+    sys.stdout.flush()
+    return int(env("EXIT", "0"))
+if __name__ == "__main__":
+    sys.exit(main())
+'''
+
+POOL_SHIM = '''import sys
+from pathlib import Path
+# The fake host scripts shadow the real ones
+sys.path[:0] = [{root!r}, {src!r}]
+import script_pool
+script_pool.SOCKET_PATH = Path({sock!r})
+script_pool.serve()
+'''
+
+ENDPOINTS = [
+    ("GET", "/setup_thinkpad_status", None),
+    ("GET", "/jobs", None),
+    ("GET", "/test_db2", None),
+    ("GET", "/test_db2?fresh=true", None),
+    ("POST", "/missouri_select", {"record_ids": ["08012011", "07012011"]}),
+    ("POST", "/backup", None),
+    ("POST", "/ocr_images", None),
+    ("GET", "/metrics", None),
+]
+
+
+# -----------------------------
+# FAKE ENVIRONMENT
+# -----------------------------
+def build_sandbox(args):
+    root = Path(tempfile.mkdtemp(prefix="backup_service_bench_"))
+    fakebin = root / "bin"
+    fakebin.mkdir()
+    for tool in FAKE_TOOLS:
+        path = fakebin / tool
+        path.write_text(FAKE_TOOL.format(python=sys.executable))
+        path.chmod(0o755)
+    os.environ["PATH"] = f"{fakebin}:{os.environ['PATH']}"
+    os.environ.setdefault("FAKE_LATENCY", str(args.latency))
+    os.environ.setdefault("FAKE_BYTES", str(args.bytes))
+    (root / "agent_shim.py").write_text(
+        AGENT_SHIM.format(src=str(HERE.parent), sock=str(root / "agent.sock")))
+    for name in ("kleopatra", "nvidia_fix", "ostree_upgrade"):
+        (root / f"{name}.py").write_text(FAKE_SCRIPT.format(name=name, upper=name.upper()))
+    (root / "pool_shim.py").write_text(
+        POOL_SHIM.format(root=str(root), src=str(HERE.parent), sock=str(root / "script_pool.sock")))
+    return root, fakebin
+
+
+def patch_service(root, fakebin, use_agent):
+    import container
+    import jobs
+    import main
+    import script_pool
+    import setup_thinkpad
+
+    main.BASE_DIR = root
+    main.UV = str(fakebin / "uv")
+    # ocr_images.py would talk HTTP to ollama; the fake CLI stands in for the whole run
+    main.OCR_SCRIPT = str(fakebin / "ollama")
+    setup_thinkpad.STATUS_FILE = root / "setup_thinkpad_status.json"
+    setup_thinkpad.LOG_FILE = root / "setup_thinkpad.log"
+    container.SOCKET_PATH = root / "agent.sock"
+    container.AGENT_SCRIPT = root / "agent_shim.py"
+    container.AGENT_LOG = root / "container_agent.log"
+    if not use_agent:
+        container.ensure_agent = lambda: False
+    script_pool.BASE_DIR = root
+    script_pool.SOCKET_PATH = root / "script_pool.sock"
+    script_pool.POOL_SCRIPT = root / "pool_shim.py"
+    script_pool.POOL_LOG = root / "script_pool.log"
+    return main, jobs
+
+
+def drain_jobs(timeout=60):
+    import jobs
+
+    deadline = time.monotonic() + timeout
+    while jobs.busy() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def stop_helpers():
+    """The agent and the pool outlive the service by design; not the sandbox's."""
+    import container
+    import script_pool
+
+    for pong in (container.ping(), script_pool.ping()):
+        if pong:
+            try:
+                os.kill(pong["pong"], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def start_server(app):
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return server, port
+
+
+# -----------------------------
+# MEASUREMENT
+# -----------------------------
+class ThreadSampler(threading.Thread):
+    """Peak thread counts while the load runs (threadpool saturation)."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak_total = 0
+        self.peak_workers = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            names = [t.name for t in threading.enumerate()]
+            workers = sum(1 for n in names if n.startswith(("AnyIO worker", "asyncio_")))
+            self.peak_total = max(self.peak_total, len(names))
+            self.peak_workers = max(self.peak_workers, workers)
+            time.sleep(0.01)
+
+
+def request(conn, method, path, body):
+    headers = {}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    t0 = time.perf_counter()
+    conn.request(method, path, body=payload, headers=headers)
+    resp = conn.getresponse()
+    resp.read()
+    return time.perf_counter() - t0, resp.status
+
+
+def drive(port, method, path, body, total, concurrency):
+    per_worker = max(1, total // concurrency)
+
+    def worker(_):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        samples, errors = [], 0
+        for _ in range(per_worker):
+            elapsed, status = request(conn, method, path, body)
+            samples.append(elapsed)
+            errors += status >= 400
+        conn.close()
+        return samples, errors
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - t0
+    samples = sorted(s for r in results for s in r[0])
+    return {
+        "endpoint": f"{method} {path}",
+        "requests": len(samples),
+        "errors": sum(r[1] for r in results),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "rps": round(len(samples) / wall, 1),
+    }
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def job_throughput(port, jobs, count):
+    """Fire count independent kleopatra jobs (single-flight off) and time them to completion."""
+    policy, jobs.DEFAULT_POLICY = jobs.DEFAULT_POLICY, "off"
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        t0 = time.perf_counter()
+        ids = []
+        for _ in range(count):
+            conn.request("POST", "/kleopatra")
+            ids.append(json.loads(conn.getresponse().read())["job_id"])
+        while any(jobs.get(i) and jobs.get(i).active for i in ids):
+            time.sleep(0.01)
+        wall = time.perf_counter() - t0
+    finally:
+        jobs.DEFAULT_POLICY = policy
+    done = [jobs.get(i) for i in ids if jobs.get(i)]
+    e2e = sorted(j.finished - j.created for j in done)
+    return {
+        "jobs": count,
+        "jobs_per_s": round(count / wall, 1),
+        "e2e_p50_ms": round(percentile(e2e, 50) * 1000, 1),
+        "e2e_p99_ms": round(percentile(e2e, 99) * 1000, 1),
+        "failed": sum(j.state != "done" for j in done),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", "--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--latency", type=float, default=0.05, help="default fake tool latency (s)")
+    parser.add_argument("--bytes", type=int, default=4096, help="default fake tool output size")
+    parser.add_argument("--jobs", type=int, default=100, help="jobs for the engine throughput run")
+    parser.add_argument("--no-agent", action="store_true", help="cold distrobox enter for every container job")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    root, fakebin = build_sandbox(args)
+    server = None
+    try:
+        main_mod, jobs = patch_service(root, fakebin, use_agent=not args.no_agent)
+        server, port = start_server(main_mod.app)
+        sampler = ThreadSampler()
+        sampler.start()
+
+        results = {"config": vars(args), "endpoints": []}
+        print(f"sandbox {root}  concurrency={args.concurrency}  requests/endpoint={args.requests}")
+        print(f"{'endpoint':<34}{'reqs':>6}{'err':>5}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+        for method, path, body in ENDPOINTS:
+            r = drive(port, method, path, body, args.requests, args.concurrency)
+            results["endpoints"].append(r)
+            print(f"{r['endpoint']:<34}{r['requests']:>6}{r['errors']:>5}"
+                  f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['rps']:>9}")
+
+        jt = job_throughput(port, jobs, args.jobs)
+        results["job_engine"] = jt
+        print(f"\njob engine: {jt['jobs']} jobs, {jt['jobs_per_s']} jobs/s, "
+              f"trigger->exit p50 {jt['e2e_p50_ms']} ms / p99 {jt['e2e_p99_ms']} ms, {jt['failed']} failed")
+
+        sampler.running = False
+        results["peak_threads"] = sampler.peak_total
+        results["peak_worker_threads"] = sampler.peak_workers
+        # ru_maxrss is KiB on Linux; includes the load generator threads
+        results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        print(f"peak threads {sampler.peak_total} (worker threads {sampler.peak_workers}), "
+              f"max RSS {results['max_rss_mb']} MB")
+
+        if args.json:
+            Path(args.json).write_text(json.dumps(results, indent=2))
+    finally:
+        if server is not None:
+            # Jobs still queued from the endpoint runs would start the agent again
+            drain_jobs()
+            server.should_exit = True
+        stop_helpers()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
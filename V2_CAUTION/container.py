@@ -0,0 +1,337 @@
+"""Run commands inside the fedora42-nvidia distrobox through container_agent.py.
+
+A cold `distrobox enter` pays podman exec + init on every call. Instead one
+agent is started per container lifetime and each command is a unix-socket
+connection to it. If the socket is dead (container restarted, agent killed)
+the agent is respawned; if that fails we fall back to a cold `distrobox enter`.
+
+Signals to a cold run's host process stop at podman exec, so a cold command
+runs as its own process group inside the container and writes that group id
+to a file under BASE_DIR (shared with the container); cancel and timeouts
+signal it there with `podman exec ... kill`.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+CONTAINER_NAME = "fedora42-nvidia"
+SOCKET_PATH = BASE_DIR / "container_agent.sock"
+AGENT_SCRIPT = BASE_DIR / "container_agent.py"
+AGENT_LOG = BASE_DIR / "container_agent.log"
+# First start of a stopped container can take a while
+AGENT_START_TIMEOUT = 60
+FRAME_LIMIT = 1 << 20
+# How often a blocking run() checks its cancel event
+CANCEL_POLL = 0.5
+# SIGTERM -> SIGKILL for a cold run that is cancelled or times out
+KILL_GRACE = 10
+
+_spawn_lock = threading.Lock()
+
+
+def cold_cmd(*argv, pgid_file=None):
+    if pgid_file is None:
+        return ["distrobox", "enter", CONTAINER_NAME, "--", *argv]
+    # setsid -w: a new process group inside the container, still waited for
+    return ["distrobox", "enter", CONTAINER_NAME, "--", "setsid", "-w",
+            "sh", "-c", 'echo $$ > "$0" && exec "$@"', str(pgid_file), *argv]
+
+
+def _pgid_file():
+    return BASE_DIR / f".cold-{uuid.uuid4().hex[:12]}.pgid"
+
+
+def read_pgid(pgid_file):
+    """The cold run's process group inside the container, once it has started."""
+    try:
+        return int(pgid_file.read_text())
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def signal_cold(host_pid, pgid, sig):
+    """Signal a cold run: its distrobox process group on the host (None once that
+    has exited) and its process group inside the container (None if unknown)."""
+    if host_pid is not None:
+        try:
+            os.killpg(host_pid, sig)
+        except ProcessLookupError:
+            pass
+    if pgid is None:
+        return
+    try:
+        subprocess.run(["podman", "exec", CONTAINER_NAME, "kill", f"-{int(sig)}", "--", f"-{pgid}"],
+                       capture_output=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+
+
+# -----------------------------
+# AGENT LIFECYCLE
+# -----------------------------
+def ping(timeout=1.0):
+    """Return the agent's pong dict, or None if nothing answers on the socket."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(b'{"ping": true}\n')
+        return json.loads(s.makefile("rb").readline() or b"null")
+    except (OSError, ValueError):
+        return None
+    finally:
+        s.close()
+
+
+def ensure_agent():
+    """Start the agent inside the container unless one already answers."""
+    if ping():
+        return True
+    with _spawn_lock:
+        if ping():
+            return True
+        with AGENT_LOG.open("a") as log:
+            subprocess.Popen(
+                cold_cmd("python3", str(AGENT_SCRIPT)),
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+        deadline = time.monotonic() + AGENT_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if ping():
+                return True
+            time.sleep(0.1)
+    return False
+
+
+# -----------------------------
+# ASYNC EXEC (job engine)
+# -----------------------------
+class AgentProcess:
+    """Looks enough like asyncio.subprocess.Process for the job engine."""
+
+    def __init__(self, argv, reader, writer):
+        self.args = argv
+        self.pid = None
+        self.returncode = None
+        self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
+        self._reader = reader
+        self._writer = writer
+        self._exited = asyncio.get_running_loop().create_future()
+
+    async def _start(self):
+        first = json.loads(await self._reader.readline() or b"{}")
+        self.pid = first.get("pid")
+        self._demux_task = asyncio.create_task(self._demux())
+
+    async def _demux(self):
+        streams = {"stdout": self.stdout, "stderr": self.stderr}
+        try:
+            while line := await self._reader.readline():
+                frame = json.loads(line)
+                if "stream" in frame:
+                    streams[frame["stream"]].feed_data(
+                        frame["data"].encode("utf-8", "surrogateescape"))
+                elif "exit" in frame:
+                    self.returncode = frame["exit"]
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if self.returncode is None:
+                # Agent went away mid-run (container stopped)
+                self.returncode = -1
+            self.stdout.feed_eof()
+            self.stderr.feed_eof()
+            self._writer.close()
+            self._exited.set_result(self.returncode)
+
+    async def wait(self):
+        return await self._exited
+
+    def send_signal(self, sig):
+        if self.returncode is None and not self._writer.is_closing():
+            self._writer.write(json.dumps({"signal": int(sig)}).encode() + b"\n")
+
+    def terminate(self):
+        self.send_signal(15)
+
+    def kill(self):
+        self.send_signal(9)
+
+
+class ColdProcess:
+    """A cold `distrobox enter` run; signals also reach its process group in the container."""
+
+    def __init__(self, argv, p, pgid_file):
+        self._p = p
+        self.args = argv
+        self.pid = p.pid
+        self.stdout = p.stdout
+        self.stderr = p.stderr
+        self.pgid_file = pgid_file
+        self._pgid = None
+
+    @property
+    def returncode(self):
+        return self._p.returncode
+
+    async def wait(self):
+        try:
+            return await self._p.wait()
+        finally:
+            self.pgid_file.unlink(missing_ok=True)
+
+    def send_signal(self, sig):
+        # Kept once read: wait() removes the file when distrobox enter exits, and
+        # the group in the container can outlive it
+        if self._pgid is None:
+            self._pgid = read_pgid(self.pgid_file)
+        host_pid = self.pid if self._p.returncode is None else None
+        # podman exec takes a moment; don't hold up the event loop for it
+        threading.Thread(target=signal_cold, args=(host_pid, self._pgid, sig), daemon=True).start()
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+async def _connect():
+    return await asyncio.open_unix_connection(str(SOCKET_PATH), limit=FRAME_LIMIT)
+
+
+async def spawn(*argv, cwd=None):
+    """Start argv inside the container; returns an AgentProcess (or a cold Process)."""
+    try:
+        reader, writer = await _connect()
+    except OSError:
+        if not await asyncio.to_thread(ensure_agent):
+            pgid_file = _pgid_file()
+            p = await asyncio.create_subprocess_exec(
+                *cold_cmd(*argv, pgid_file=pgid_file),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+            return ColdProcess(list(argv), p, pgid_file)
+        reader, writer = await _connect()
+
+    writer.write(json.dumps({"argv": list(argv), "cwd": cwd and str(cwd)}).encode() + b"\n")
+    await writer.drain()
+    p = AgentProcess(list(argv), reader, writer)
+    await p._start()
+    return p
+
+
+# -----------------------------
+# SYNC RUN (setup_thinkpad, probes)
+# -----------------------------
+def run(argv, cwd=None, timeout=None, cancel=None):
+    """subprocess.run(..., capture_output=True, text=True) equivalent inside the container.
+
+    timeout bounds the whole run (subprocess.TimeoutExpired). Setting the cancel
+    threading.Event stops it early with returncode -SIGTERM. Either way the socket
+    is closed and the agent kills the command's process group.
+    """
+    if not ensure_agent():
+        pgid_file = _pgid_file()
+        return run_cold(cold_cmd(*argv, pgid_file=pgid_file), argv, timeout, cancel, pgid_file)
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(json.dumps({"argv": list(argv), "cwd": cwd and str(cwd)}).encode() + b"\n")
+        return collect(s, argv, timeout, cancel)
+    except socket.timeout:
+        raise subprocess.TimeoutExpired(argv, timeout)
+    finally:
+        s.close()
+
+
+def run_cold(cmd, argv, timeout=None, cancel=None, pgid_file=None):
+    """run() without the agent: cmd in its own session, honouring timeout and cancel.
+
+    pgid_file is the cold_cmd() one, to reach the process group inside the
+    container too. Also used by script_pool for its cold python3 runs.
+    """
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                         start_new_session=True)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            wait = CANCEL_POLL if cancel is not None else None
+            if deadline is not None:
+                wait = max(0, min(wait or timeout, deadline - time.monotonic()))
+            try:
+                out, err = p.communicate(timeout=wait)
+                return subprocess.CompletedProcess(argv, p.returncode, out, err)
+            except subprocess.TimeoutExpired:
+                pass
+            if cancel is not None and cancel.is_set():
+                out, err = _stop_cold(p, pgid_file)
+                return subprocess.CompletedProcess(argv, -signal.SIGTERM, out, err)
+            if deadline is not None and time.monotonic() >= deadline:
+                out, err = _stop_cold(p, pgid_file)
+                raise subprocess.TimeoutExpired(argv, timeout, out, err)
+    finally:
+        if pgid_file is not None:
+            pgid_file.unlink(missing_ok=True)
+
+
+def _stop_cold(p, pgid_file):
+    pgid = read_pgid(pgid_file)
+    signal_cold(p.pid, pgid, signal.SIGTERM)
+    try:
+        return p.communicate(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        signal_cold(p.pid if p.returncode is None else None, pgid or read_pgid(pgid_file),
+                    signal.SIGKILL)
+        return p.communicate()
+
+
+def collect(s, argv, timeout=None, cancel=None):
+    """Read a run's frames from socket s into a CompletedProcess (also used by script_pool)."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    out, err, rc = [], [], -1
+    buf = b""
+    while True:
+        wait = CANCEL_POLL if cancel is not None else None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(argv, timeout, _text(out), _text(err))
+            wait = min(wait or remaining, remaining)
+        if cancel is not None and cancel.is_set():
+            return subprocess.CompletedProcess(argv, -signal.SIGTERM, _text(out), _text(err))
+        s.settimeout(wait)
+        try:
+            chunk = s.recv(65536)
+        except socket.timeout:
+            continue
+        if not chunk:
+            break
+        *lines, buf = (buf + chunk).split(b"\n")
+        for line in lines:
+            frame = json.loads(line)
+            if "stream" in frame:
+                (out if frame["stream"] == "stdout" else err).append(frame["data"])
+            elif "exit" in frame:
+                rc = frame["exit"]
+    return subprocess.CompletedProcess(argv, rc, _text(out), _text(err))
+
+
+def _text(parts):
+    return "".join(parts).encode("utf-8", "surrogateescape").decode(errors="replace")
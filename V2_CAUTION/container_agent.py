@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Long-lived exec agent for the fedora42-nvidia distrobox.
+# This script runs INSIDE the container (started by container.py on the host via
+# a single `distrobox enter`) and listens on a unix socket in the shared home dir.
+#
+# Protocol: one JSON object per line.
+#   client -> agent   {"argv": [...], "cwd": "..."}   or   {"ping": true}
+#   agent  -> client  {"pid": n}, then {"stream": "stdout"|"stderr", "data": "..."}*,
+#                     then {"exit": returncode}
+#   client -> agent   {"signal": n}   forwarded to the child's process group
+# If the client disconnects while the child is running, the group gets SIGTERM,
+# then SIGKILL after KILL_GRACE seconds.
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+from pathlib import Path
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+SOCKET_PATH = BASE_DIR / "container_agent.sock"
+READ_CHUNK = 65536
+KILL_GRACE = 10
+
+
+def send(writer, obj):
+    writer.write(json.dumps(obj).encode() + b"\n")
+
+
+def already_running():
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(str(SOCKET_PATH))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+async def pump(stream, name, writer):
+    while chunk := await stream.read(READ_CHUNK):
+        send(writer, {"stream": name, "data": chunk.decode("utf-8", "surrogateescape")})
+        await writer.drain()
+
+
+def killpg(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def handle(reader, writer):
+    try:
+        req = json.loads(await reader.readline() or b"{}")
+    except json.JSONDecodeError:
+        writer.close()
+        return
+
+    if req.get("ping"):
+        send(writer, {"pong": os.getpid(), "host": socket.gethostname()})
+        await writer.drain()
+        writer.close()
+        return
+
+    try:
+        p = await asyncio.create_subprocess_exec(
+            *req["argv"],
+            cwd=req.get("cwd") or None,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+    except (OSError, KeyError) as e:
+        send(writer, {"pid": None})
+        send(writer, {"stream": "stderr", "data": f"container_agent: {e}\n"})
+        send(writer, {"exit": 127})
+        await writer.drain()
+        writer.close()
+        return
+
+    send(writer, {"pid": p.pid})
+    await writer.drain()
+
+    async def control():
+        # Signals from the host; EOF means the host gave up on this job.
+        while line := await reader.readline():
+            msg = json.loads(line)
+            if "signal" in msg:
+                killpg(p.pid, int(msg["signal"]))
+        await stop()
+
+    async def stop():
+        if p.returncode is None:
+            killpg(p.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(p.wait(), KILL_GRACE)
+            except asyncio.TimeoutError:
+                killpg(p.pid, signal.SIGKILL)
+
+    ctl = asyncio.create_task(control())
+    try:
+        await asyncio.gather(pump(p.stdout, "stdout", writer), pump(p.stderr, "stderr", writer))
+        send(writer, {"exit": await p.wait()})
+        await writer.drain()
+    except ConnectionError:
+        await stop()
+    finally:
+        ctl.cancel()
+        writer.close()
+
+
+async def main():
+    if already_running():
+        print("[container_agent] another agent is already listening, exiting")
+        return
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = await asyncio.start_unix_server(handle, path=str(SOCKET_PATH))
+    os.chmod(SOCKET_PATH, 0o600)
+    print(f"[container_agent] listening on {SOCKET_PATH} (pid {os.getpid()})", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(0)
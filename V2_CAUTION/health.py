@@ -0,0 +1,237 @@
+"""System health probes behind one cached GET /health.
+
+Cheap probes read files the kernel or a daemon already keeps up to date and
+run inline on every request, in microseconds:
+  kargs          /proc/cmdline has nvidia_fix.REQUIRED_ARGS
+  nvidia_driver  /proc/driver/nvidia is there and nouveau isn't loaded
+  yubikey        a USB device with Yubico's vendor id (1050) in /sys
+  pcscd          the pcscd socket exists (socket activated on Fedora)
+  disk           free space where the backups and logs live
+  ostree         the last rpm-ostree prestage result (ostree_prestage.json)
+
+Expensive probes fork a tool or talk to another process. Their results are
+cached for TTL seconds and refreshed in the background, only when a request
+finds them missing or expired, or when it asks for refresh=True. A request
+never waits for them; it gets the last result marked "stale", or
+"pending" before the first one.
+  gpu            nvidia-smi inside the container
+  card           gpg --card-status (the card answers, not just the USB device)
+  ollama, container_agent, script_pool   the service's helpers answer a ping
+"""
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import container
+import metrics
+import ollama_manager
+import ostree_upgrade
+import script_pool
+from kleopatra import PCSCD_SOCKET, yubikey_device
+from nvidia_fix import REQUIRED_ARGS
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+PROC_CMDLINE = Path("/proc/cmdline")
+NVIDIA_PROC = Path("/proc/driver/nvidia")
+NOUVEAU_MODULE = Path("/sys/module/nouveau")
+# Below this many free bytes the disk probe fails
+MIN_FREE = 10 * 1024 ** 3
+
+PROBE_TIMEOUT = 30
+# Seconds an expensive probe's result is served before it is refreshed
+TTL = {
+    "gpu": 120,
+    "card": 300,
+    "ollama": 15,
+    "container_agent": 30,
+    "script_pool": 30,
+}
+
+_cache = {}          # name -> (result dict, checked_at)
+_refreshing = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="health")
+
+
+# -----------------------------
+# CHEAP PROBES
+# -----------------------------
+def kargs():
+    current = PROC_CMDLINE.read_text().split()
+    missing = [arg for arg in REQUIRED_ARGS if arg not in current]
+    return {"ok": not missing, "missing": missing}
+
+
+def nvidia_driver():
+    version = NVIDIA_PROC / "version"
+    if not version.exists():
+        return {"ok": False, "detail": "nvidia kernel module not loaded",
+                "nouveau": NOUVEAU_MODULE.exists()}
+    first = version.read_text().splitlines()[0]
+    return {"ok": not NOUVEAU_MODULE.exists(), "detail": first.strip(),
+            "nouveau": NOUVEAU_MODULE.exists()}
+
+
+def yubikey():
+    name = yubikey_device()
+    return {"ok": True, "detail": name} if name else {"ok": False, "detail": "no Yubico USB device"}
+
+
+def pcscd():
+    present = PCSCD_SOCKET.exists()
+    return {"ok": present, "detail": str(PCSCD_SOCKET) if present else "pcscd socket missing"}
+
+
+def disk():
+    usage = shutil.disk_usage(BASE_DIR)
+    return {"ok": usage.free >= MIN_FREE, "free_gb": round(usage.free / 1024 ** 3, 1),
+            "used_pct": round(100 * usage.used / usage.total, 1)}
+
+
+def ostree():
+    cache = ostree_upgrade.load_cache()
+    state = ostree_upgrade.cached_state(cache)
+    if state is None:
+        # Not checked since boot, or too long ago; informational only
+        return {"ok": None, "detail": "not checked", "checked": cache.get("checked")}
+    detail = {"up_to_date": "up to date", "staged": "deployment staged, reboot to apply"}[state]
+    return {"ok": True, "detail": detail, "checked": cache["checked"],
+            "update_downloaded": cache.get("downloaded", False)}
+
+
+# -----------------------------
+# EXPENSIVE PROBES
+# -----------------------------
+def gpu():
+    result = container.run(
+        ["nvidia-smi", "--query-gpu=name,driver_version,memory.used,memory.total",
+         "--format=csv,noheader,nounits"],
+        timeout=PROBE_TIMEOUT,
+    )
+    if result.returncode != 0:
+        return {"ok": False, "detail": (result.stderr or result.stdout).strip()[-300:]}
+    name, driver, used, total = [f.strip() for f in result.stdout.splitlines()[0].split(",")]
+    return {"ok": True, "detail": name, "driver": driver,
+            "memory_used_mb": int(used), "memory_total_mb": int(total)}
+
+
+def card():
+    result = subprocess.run(["gpg", "--card-status"], capture_output=True, text=True,
+                            timeout=PROBE_TIMEOUT)
+    if result.returncode != 0:
+        return {"ok": False, "detail": result.stderr.strip()[-300:]}
+    serial = next((line.split(":", 1)[1].strip() for line in result.stdout.splitlines()
+                   if line.startswith("Serial number")), None)
+    return {"ok": True, "detail": "card answers", "serial": serial}
+
+
+def ollama():
+    version = ollama_manager.version()
+    # Only started on demand, so "not running" isn't a failure
+    return {"ok": None if version is None else True,
+            "detail": f"ollama {version}" if version else "not running"}
+
+
+def container_agent():
+    pong = container.ping()
+    return {"ok": None if pong is None else True,
+            "detail": f"pid {pong['pong']}" if pong else "not started"}
+
+
+def pool():
+    pong = script_pool.ping()
+    return {"ok": bool(pong), "detail": f"pid {pong['pong']}" if pong else "not answering"}
+
+
+CHEAP = {
+    "kargs": kargs,
+    "nvidia_driver": nvidia_driver,
+    "yubikey": yubikey,
+    "pcscd": pcscd,
+    "disk": disk,
+    "ostree": ostree,
+}
+EXPENSIVE = {
+    "gpu": gpu,
+    "card": card,
+    "ollama": ollama,
+    "container_agent": container_agent,
+    "script_pool": pool,
+}
+
+
+def _safe(fn):
+    try:
+        return fn()
+    except Exception as e:
+        return {"ok": False, "detail": f"{type(e).__name__}: {e}"}
+
+
+def _refresh(name):
+    with _lock:
+        if name in _refreshing:
+            return
+        _refreshing.add(name)
+    _executor.submit(_run, name)
+
+
+def _run(name):
+    try:
+        record(name, _safe(EXPENSIVE[name]))
+    finally:
+        with _lock:
+            _refreshing.discard(name)
+
+
+def record(name, result):
+    """Store an expensive probe's result, e.g. from a job that just ran the same check."""
+    with _lock:
+        _cache[name] = (result, time.monotonic())
+
+
+def check(refresh=False, names=None):
+    """All probes now: cheap ones run inline, expensive ones come from the cache.
+
+    Missing or expired (or all, with refresh) expensive results are refreshed in
+    the background for the next request.
+    """
+    t0 = time.perf_counter()
+    now = time.monotonic()
+    probes = {}
+    for name, fn in CHEAP.items():
+        if names is None or name in names:
+            probes[name] = _safe(fn)
+    for name in EXPENSIVE:
+        if names is not None and name not in names:
+            continue
+        with _lock:
+            cached = _cache.get(name)
+            running = name in _refreshing
+        expired = cached is None or now - cached[1] > TTL[name]
+        if refresh or expired:
+            _refresh(name)
+            running = True
+        if cached is None:
+            probes[name] = {"ok": None, "detail": "pending", "refreshing": running}
+        else:
+            result, checked = cached
+            probes[name] = {**result, "age_s": round(now - checked, 1),
+                            "stale": expired, "refreshing": running}
+    return {
+        # None = unknown/not applicable, doesn't count against the total
+        "ok": all(p["ok"] is not False for p in probes.values()),
+        "probes": probes,
+        "checked_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+
+@metrics.collector
+def _health_gauges():
+    with _lock:
+        cached = {name: result for name, (result, _) in _cache.items()}
+    values = {(name,): int(bool(r["ok"])) for name, r in cached.items() if r["ok"] is not None}
+    return [("backup_service_health_ok", "Last result of each expensive health probe (1 = ok)",
+             "gauge", ("probe",), values)]
@@ -0,0 +1,484 @@
+import asyncio
+import itertools
+import json
+import os
+import signal
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import container
+import logstore
+import metrics
+import scheduler
+import script_pool
+from logstore import ts
+
+# Finished jobs kept in memory for GET /jobs before the oldest are dropped.
+MAX_FINISHED = 200
+# Output lines kept per job for /jobs/{id}/stream; older lines only live in the log file.
+LINE_BUFFER = 500
+# Longer lines are split so a child printing without newlines can't grow memory.
+MAX_LINE = 8192
+READ_CHUNK = 65536
+
+# Single-flight: what a trigger does while the same task is already queued or running.
+#   "attach" - return the in-flight job, nothing new is started
+#   "rerun"  - attach, but also run once more after the current run (for tasks whose
+#              input may have changed meanwhile, e.g. new images or voice memos)
+#   "off"    - always start a new job
+DEFAULT_POLICY = "attach"
+SINGLE_FLIGHT = {
+    "ocr_images": "rerun",
+    "cohere_transcription": "rerun",
+}
+
+# Resource classes a task holds while it runs (limits in scheduler.LIMITS). Jobs that
+# share a class queue behind each other; tasks not listed only count towards
+# scheduler.MAX_RUNNING.
+RESOURCES = {
+    "ocr_images": ("gpu",),
+    "cohere_transcription": ("gpu",),
+    "ollama_on": ("gpu",),
+    "ollama_off": ("gpu",),
+    "backup": ("backup-disk",),
+    "restic_maintenance": ("backup-disk",),
+    "ostree_upgrade": ("system-update", "backup-disk"),
+    "ostree_prestage": ("system-update", "backup-disk"),
+    "nvidia_fix": ("system-update", "gpu"),
+    "setup_thinkpad": ("system-update", "gpu", "backup-disk"),
+    "reboot": ("system-update", "gpu", "backup-disk"),
+}
+# Higher starts first when several jobs wait for the same class (default 0)
+PRIORITY = {
+    "reboot": 20,
+    "setup_thinkpad": 10,
+    "nvidia_fix": 10,
+    "ollama_on": 5,
+    "ollama_off": 5,
+    "ostree_upgrade": 5,
+    "restic_maintenance": -10,
+    "ostree_prestage": -10,
+}
+# Seconds a job may run (once started) before its process group is killed
+TIMEOUTS = {
+    "backup": 6 * 3600,
+    "restic_maintenance": 6 * 3600,
+    "setup_thinkpad": 6 * 3600,
+    "ocr_images": 2 * 3600,
+    "cohere_transcription": 2 * 3600,
+    "ostree_upgrade": 3600,
+    "ostree_prestage": 3600,
+    "nvidia_fix": 600,
+    "ollama_on": 300,
+    "vscode_on": 300,
+    "kleopatra": 120,
+    "ollama_off": 120,
+    "vscode_off": 120,
+    "reboot": 120,
+}
+DEFAULT_TIMEOUT = 3600
+# Between SIGTERM and SIGKILL when a job is cancelled or times out
+KILL_GRACE = 10
+# Past runs read from a task's log index to seed its expected run time after a restart
+ESTIMATE_RUNS = 5
+# task -> blocking callable run (in a thread) once the job holds its resource classes,
+# before it starts; e.g. evicting another task's model that outlives its job in VRAM.
+# Registered by main.py.
+ON_START = {}
+
+JOBS = {}
+_finished = []
+_tasks = set()
+_seeded = set()
+_counter = itertools.count(1)
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+def write_log(path, header, stdout, stderr):
+    logstore.rotate_if_needed(path)
+    with open(path, "a") as f:
+        f.write(f"\n=== {header} @ {ts()} ===\n")
+        f.write("STDOUT:\n")
+        f.write(stdout or "")
+        f.write("\nSTDERR:\n")
+        f.write(stderr or "")
+        f.write(f"\n=== END @ {ts()} ===\n")
+
+
+# -----------------------------
+# JOB RECORD
+# -----------------------------
+class Job:
+    def __init__(self, task, cmd=None, func=None, log_path=None, header=None,
+                 in_container=False, in_pool=False, on_cancel=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.seq = next(_counter)
+        self.task = task
+        self.cmd = cmd
+        self.func = func
+        self.in_container = in_container
+        self.in_pool = in_pool
+        self.on_cancel = on_cancel
+        self.timeout = TIMEOUTS.get(task, DEFAULT_TIMEOUT)
+        self.stop_reason = None
+        self.after = None
+        self.resources = RESOURCES.get(task, ())
+        self.priority = PRIORITY.get(task, 0)
+        self.triggers = 1
+        self.log_path = log_path
+        self.header = header or f"{task.upper()} TRIGGERED"
+        self.state = "queued"
+        self.pid = None
+        self.returncode = None
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = None
+        self.lines = deque(maxlen=LINE_BUFFER)
+        self.line_count = 0
+        self.output_bytes = 0
+        self._changed = asyncio.Event()
+
+    def add_line(self, stream, line):
+        self.line_count += 1
+        self.lines.append((self.line_count, stream, line))
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def to_dict(self, queue=None):
+        """queue: scheduler.forecast(), when the caller already has one."""
+        if queue is None and self.state == "queued":
+            queue = scheduler.forecast()
+        waiting = (queue or {}).get(self.id, {})
+        if self.after is not None:
+            waiting = {"queue_position": None, "estimated_start": None,
+                       "waiting_on": [self.after.id]}
+        return {
+            "id": self.id,
+            "task": self.task,
+            "state": self.state,
+            "pid": self.pid,
+            "returncode": self.returncode,
+            "error": self.error,
+            "result": self.result,
+            "triggers": self.triggers,
+            "after": self.after.id if self.after else None,
+            "resources": list(self.resources),
+            "priority": self.priority,
+            "timeout": self.timeout,
+            "queue_position": waiting.get("queue_position"),
+            "estimated_start": _iso(waiting.get("estimated_start")),
+            "waiting_on": waiting.get("waiting_on"),
+            "lines": self.line_count,
+            "output_bytes": self.output_bytes,
+            "created": _iso(self.created),
+            "started": _iso(self.started),
+            "finished": _iso(self.finished),
+            "duration": (
+                round(self.finished - self.started, 3)
+                if self.started and self.finished else None
+            ),
+        }
+
+
+def _iso(t):
+    return datetime.fromtimestamp(t).isoformat() if t else None
+
+
+# -----------------------------
+# ENGINE
+# -----------------------------
+def submit(task, cmd=None, func=None, log_path=None, header=None, in_container=False,
+           in_pool=False, on_cancel=None):
+    """Queue a child process (cmd) or a blocking callable (func) and return its Job.
+
+    in_container runs cmd inside the distrobox via the container agent.
+    in_pool runs the host script cmd[0] (see script_pool.TASKS) forked from the script pool,
+    with cmd[1:] as its arguments.
+    A trigger for a task that is already in flight is coalesced according to
+    SINGLE_FLIGHT and gets the existing job back (job.triggers > 1).
+    on_cancel() is called (in a thread) when a running func job is cancelled or
+    times out; the thread itself can't be killed, so func should stop soon after.
+    Must be called from the event loop (i.e. from an async endpoint).
+    """
+    policy = SINGLE_FLIGHT.get(task, DEFAULT_POLICY)
+    inflight = [j for j in JOBS.values() if j.task == task and j.active]
+    queued = [j for j in inflight if j.state == "queued"]
+    after = None
+    if policy != "off" and inflight:
+        if policy == "attach" or queued:
+            existing = queued[-1] if policy == "rerun" else inflight[0]
+            existing.triggers += 1
+            return existing
+        after = inflight[-1]
+
+    job = Job(task, cmd=cmd, func=func, log_path=log_path, header=header,
+              in_container=in_container, in_pool=in_pool, on_cancel=on_cancel)
+    job.after = after
+    JOBS[job.id] = job
+    t = job._task = asyncio.get_running_loop().create_task(_run(job))
+    _tasks.add(t)
+    t.add_done_callback(_tasks.discard)
+    return job
+
+
+def get(job_id):
+    return JOBS.get(job_id)
+
+
+def cancel(job):
+    """Stop a queued or running job; False if it had already finished.
+
+    A queued job is dropped from the scheduler queue. A running one gets SIGTERM
+    on its whole process group (through the agent for container and pool jobs),
+    then SIGKILL after KILL_GRACE. Output so far stays in the log and the job.
+    """
+    if not job.active:
+        return False
+    job.stop_reason = job.stop_reason or "cancelled"
+    if job.state == "queued":
+        job._task.cancel()
+    else:
+        job._stop.set()
+    return True
+
+
+def busy(*tasks):
+    """True while any job for one of tasks (any task at all if none given) is queued or running."""
+    return any(j.active and (not tasks or j.task in tasks) for j in JOBS.values())
+
+
+def list_jobs(task=None):
+    jobs = sorted(JOBS.values(), key=lambda j: j.seq, reverse=True)
+    queue = scheduler.forecast()
+    return [j.to_dict(queue) for j in jobs if task is None or j.task == task]
+
+
+async def _run(job):
+    try:
+        if job.after is not None:
+            await job.after.done.wait()
+            job.after = None
+
+        if job.task not in _seeded:
+            _seeded.add(job.task)
+            if job.log_path and scheduler.expected(job.task) is None:
+                for seconds in await asyncio.to_thread(
+                        logstore.run_seconds, job.log_path, ESTIMATE_RUNS, job.task):
+                    scheduler.record(job.task, seconds)
+
+        async with scheduler.hold(job.resources, job.id, job.task, job.priority):
+            job.state = "running"
+            job.started = time.time()
+            metrics.JOB_QUEUE_WAIT.observe((job.task,), job.started - job.created)
+            await _on_start(job)
+            try:
+                if job.cmd is not None:
+                    await _run_process(job)
+                else:
+                    await _run_func(job)
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.returncode = job.returncode if job.returncode is not None else -1
+            job.finished = time.time()
+            if job.stop_reason:
+                job.state = job.stop_reason
+                job.error = job.error or (
+                    f"timed out after {job.timeout}s" if job.stop_reason == "timed_out"
+                    else f"cancelled after {job.finished - job.started:.1f}s")
+            else:
+                job.state = "done" if job.returncode == 0 else "failed"
+            metrics.JOB_RUN.observe((job.task,), job.finished - job.started)
+            if job.state == "done":
+                scheduler.record(job.task, job.finished - job.started)
+            metrics.JOB_EXITS.inc((job.task, str(job.returncode)))
+    except asyncio.CancelledError:
+        # Cancelled while still queued; nothing was started
+        job.state = "cancelled"
+        job.finished = time.time()
+        job.error = "cancelled before it started"
+
+    job.done.set()
+    job._notify()
+    _retire(job)
+
+
+async def _on_start(job):
+    hook = ON_START.get(job.task)
+    if hook is None:
+        return
+    try:
+        note = await asyncio.to_thread(hook)
+    except Exception as e:
+        # Not worth failing the job over; at worst it shares the GPU as before
+        job.add_line("stderr", f"start hook failed: {type(e).__name__}: {e}")
+        return
+    if note:
+        job.add_line("stdout", note)
+
+
+async def _run_process(job):
+    log = None
+    if job.log_path:
+        # May compress the previous segment first, so keep it off the loop
+        log = await asyncio.to_thread(
+            logstore.open_run, job.log_path, job.id, job.task, job.header)
+    try:
+        spawn_start = time.monotonic()
+        if job.in_container:
+            p = await container.spawn(*job.cmd)
+        elif job.in_pool:
+            p = await script_pool.spawn(*job.cmd)
+        else:
+            # Own session, so cancel/timeout can kill everything it starts
+            p = await asyncio.create_subprocess_exec(
+                *job.cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        job.pid = p.pid
+        metrics.JOB_SPAWN.observe((job.task,), time.monotonic() - spawn_start)
+        watchdog = asyncio.create_task(_watchdog(job, p))
+        try:
+            await asyncio.gather(
+                _pump(job, p.stdout, "stdout", log),
+                _pump(job, p.stderr, "stderr", log),
+            )
+            job.returncode = await p.wait()
+        finally:
+            watchdog.cancel()
+    finally:
+        if log:
+            if job.stop_reason:
+                log.write(f"=== {job.stop_reason.upper().replace('_', ' ')} @ {ts()} ===\n")
+            log.close(job.returncode)
+
+
+async def _stopped(job):
+    """Wait for cancel() or the job's timeout, whichever comes first."""
+    try:
+        await asyncio.wait_for(job._stop.wait(), job.timeout)
+    except asyncio.TimeoutError:
+        job.stop_reason = job.stop_reason or "timed_out"
+
+
+async def _watchdog(job, p):
+    await _stopped(job)
+    _signal(p, signal.SIGTERM)
+    try:
+        # shield: an AgentProcess's wait() is its exit future, which must not be cancelled
+        await asyncio.wait_for(asyncio.shield(p.wait()), KILL_GRACE)
+    except asyncio.TimeoutError:
+        _signal(p, signal.SIGKILL)
+
+
+def _signal(p, sig):
+    if isinstance(p, (container.AgentProcess, container.ColdProcess)):
+        # The container agent / script pool signals the child's process group;
+        # a cold container run signals its group inside the container as well
+        p.send_signal(sig)
+        return
+    try:
+        os.killpg(p.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _run_func(job):
+    work = asyncio.ensure_future(asyncio.to_thread(job.func))
+    stop = asyncio.ensure_future(_stopped(job))
+    await asyncio.wait((work, stop), return_when=asyncio.FIRST_COMPLETED)
+    if not work.done():
+        # Threads can't be killed: ask func to stop and keep the job's scheduler
+        # slot until it has, so nothing else starts on the same resources meanwhile
+        if job.on_cancel is not None:
+            await asyncio.to_thread(job.on_cancel)
+    stop.cancel()
+    job.result = await work
+    job.returncode = 0
+
+
+async def _pump(job, stream, name, log):
+    """Copy one pipe into the log and the job's line buffer as output arrives."""
+    prefix = "" if name == "stdout" else "STDERR: "
+    partial = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        job.output_bytes += len(chunk)
+        metrics.JOB_OUTPUT_BYTES.inc((job.task,), len(chunk))
+        *complete, partial = (partial + chunk).split(b"\n")
+        # Over-long lines are emitted in MAX_LINE pieces rather than held
+        while len(partial) > MAX_LINE:
+            complete.append(partial[:MAX_LINE])
+            partial = partial[MAX_LINE:]
+        for raw in complete:
+            _emit(job, name, raw, log, prefix)
+        if log:
+            log.flush()
+    if partial:
+        _emit(job, name, partial, log, prefix)
+        if log:
+            log.flush()
+
+
+def _emit(job, name, raw, log, prefix):
+    # Progress bars (restic, rpm-ostree, dnf) redraw with bare \r; keep what the
+    # terminal would end up showing. A \r left in an SSE data: line splits the event.
+    raw = raw.rstrip(b"\r").rsplit(b"\r", 1)[-1]
+    for i in range(0, max(len(raw), 1), MAX_LINE):
+        line = raw[i:i + MAX_LINE].decode(errors="replace")
+        job.add_line(name, line)
+        if log:
+            log.write(f"{prefix}{line}\n")
+
+
+async def stream_events(job, since=0):
+    """Yield Server-Sent Events for a job's output, following it until it ends.
+
+    Lines that already fell out of the bounded buffer are skipped.
+    """
+    seq = since
+    while True:
+        changed = job._changed
+        for n, name, line in list(job.lines):
+            if n > seq:
+                yield f"id: {n}\nevent: {name}\ndata: {line}\n\n"
+                seq = n
+        if not job.active:
+            yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+            return
+        await changed.wait()
+
+
+@metrics.collector
+def _job_gauges():
+    counts = {}
+    for j in JOBS.values():
+        if j.active:
+            counts[(j.task, j.state)] = counts.get((j.task, j.state), 0) + 1
+    return [("backup_service_jobs_active", "Queued and running jobs", "gauge",
+             ("task", "state"), counts)]
+
+
+def _retire(job):
+    _finished.append(job.id)
+    while len(_finished) > MAX_FINISHED:
+        JOBS.pop(_finished.pop(0), None)
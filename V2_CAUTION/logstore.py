@@ -0,0 +1,194 @@
+"""Rotating, compressed, indexed .log files.
+
+A log over MAX_BYTES is rotated to <name>.log.<gen>.gz; only the newest
+KEEP_SEGMENTS segments are kept. Job runs also append one line per run to
+<name>.log.idx (job, task, segment, start/end byte offsets, exit code), so
+GET /logs/{task}?last=N can seek straight to the last N runs.
+"""
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+MAX_BYTES = 5 * 1024 * 1024
+KEEP_SEGMENTS = 8
+TAIL_BLOCK = 64 * 1024
+
+_lock = threading.Lock()
+
+
+def ts():
+    return datetime.now().strftime("%Y-%m-%d %I:%M %p")
+
+
+def _index_path(path):
+    return path.with_name(path.name + ".idx")
+
+
+def _segments(path):
+    """Rotated generations of path, oldest first."""
+    pattern = re.compile(re.escape(path.name) + r"\.(\d+)\.gz$")
+    gens = []
+    for entry in os.scandir(path.parent):
+        m = pattern.match(entry.name)
+        if m:
+            gens.append(int(m.group(1)))
+    return sorted(gens)
+
+
+def live_gen(path):
+    gens = _segments(path)
+    return gens[-1] + 1 if gens else 0
+
+
+def rotate_if_needed(path):
+    """Compress path into the next segment if it has grown past MAX_BYTES."""
+    try:
+        if path.stat().st_size < MAX_BYTES:
+            return False
+    except FileNotFoundError:
+        return False
+    with _lock:
+        gen = live_gen(path)
+        rotated = path.with_name(f"{path.name}.{gen}")
+        try:
+            os.replace(path, rotated)
+        except FileNotFoundError:
+            # rotated by someone else meanwhile
+            return False
+        with rotated.open("rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        rotated.unlink()
+
+        gens = _segments(path)
+        for old in gens[:-KEEP_SEGMENTS]:
+            path.with_name(f"{path.name}.{old}.gz").unlink(missing_ok=True)
+        if len(gens) > KEEP_SEGMENTS:
+            _trim_index(path, gens[-KEEP_SEGMENTS])
+    return True
+
+
+def _trim_index(path, oldest_gen):
+    idx = _index_path(path)
+    if not idx.exists():
+        return
+    keep = [line for line in idx.read_text().splitlines()
+            if line and json.loads(line)["gen"] >= oldest_gen]
+    tmp = idx.with_name(idx.name + ".tmp")
+    tmp.write_text("".join(line + "\n" for line in keep))
+    os.replace(tmp, idx)
+
+
+def append_line(path, line):
+    """Plain append for the per-script log() helpers, with rotation."""
+    rotate_if_needed(path)
+    with path.open("a") as f:
+        f.write(line + "\n")
+
+
+# -----------------------------
+# INDEXED RUNS (job engine)
+# -----------------------------
+class Run:
+    """One job's section of a log file. Open with open_run(); close() writes the index entry."""
+
+    def __init__(self, path, job_id, task, header):
+        rotate_if_needed(path)
+        self.path = path
+        self.job_id = job_id
+        self.task = task
+        self.gen = live_gen(path)
+        self.started = datetime.now().isoformat()
+        self._f = path.open("ab")
+        self.start = self._f.tell()
+        self.write(f"\n=== {header} @ {ts()} ===\n")
+        self.flush()
+
+    def write(self, text):
+        self._f.write(text.encode(errors="replace"))
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self, returncode):
+        self.write(f"=== END @ {ts()} (exit {returncode}) ===\n")
+        end = self._f.tell()
+        self._f.close()
+        entry = {
+            "job": self.job_id, "task": self.task, "gen": self.gen,
+            "start": self.start, "end": end, "exit": returncode,
+            "started": self.started, "finished": datetime.now().isoformat(),
+        }
+        with _lock, _index_path(self.path).open("a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def open_run(path, job_id, task, header):
+    return Run(path, job_id, task, header)
+
+
+# -----------------------------
+# READING
+# -----------------------------
+def _read_span(path, entry, live):
+    if entry["gen"] == live:
+        with path.open("rb") as f:
+            f.seek(entry["start"])
+            return f.read(entry["end"] - entry["start"])
+    seg = path.with_name(f"{path.name}.{entry['gen']}.gz")
+    if not seg.exists():
+        return b""
+    with gzip.open(seg, "rb") as f:
+        f.seek(entry["start"])
+        return f.read(entry["end"] - entry["start"])
+
+
+def _tail_index(path, n, task=None):
+    idx = _index_path(path)
+    if not idx.exists():
+        return None
+    entries = [json.loads(line) for line in idx.read_text().splitlines() if line]
+    if task is not None:
+        entries = [e for e in entries if e["task"] == task]
+    return entries[-n:]
+
+
+def last_runs(path, n, task=None):
+    """The last n indexed runs with their output, newest last. None if path has no index."""
+    entries = _tail_index(path, n, task)
+    if entries is None:
+        return None
+    live = live_gen(path)
+    return [
+        {**e, "output": _read_span(path, e, live).decode(errors="replace")}
+        for e in entries
+    ]
+
+
+def run_seconds(path, n, task=None):
+    """Durations of the last n successful indexed runs, oldest first."""
+    seconds = []
+    for e in _tail_index(path, n, task) or []:
+        if e["exit"] == 0:
+            started = datetime.fromisoformat(e["started"])
+            seconds.append((datetime.fromisoformat(e["finished"]) - started).total_seconds())
+    return seconds
+
+
+def tail_lines(path, n):
+    """Last n lines of a (non-indexed) log, read backwards from the end."""
+    if not path.exists():
+        return []
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return data.decode(errors="replace").splitlines()[-n:]
@@ -1,48 +1,99 @@
-from fastapi import FastAPI, BackgroundTasks, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-import subprocess
+import startup
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pathlib import Path
 from datetime import datetime
 import json
-import webbrowser
+import subprocess
+import time
 from threading import Timer
-from setup_thinkpad import run_setup, load_status, new_status, save_status
-from missouri_query import (
-    run_missouri_query,
-    run_missouri_select,
-    run_missouri_delete,
-    run_missouri_update,
-    run_missouri_insert
-)
-
-app = FastAPI()
-
-# Host scripts
-KLEO_SCRIPT = Path("/var/home/fraser/backup_service/kleopatra.py")
-NVIDIA_SCRIPT = Path("/var/home/fraser/backup_service/nvidia_fix.py")
-COHERE_SCRIPT = Path("/var/home/fraser/machine_learning/cohere_transcribe/batch_transcribe.py")
-
-
-# Container script
-BACKUP_SCRIPT = "/var/home/fraser/backup_service/backup.py"
-CONTAINER_NAME = "fedora42-nvidia"
+import asyncio
+import jobs
+import logstore
+import metrics
+import page_cache
+from batcher import MicroBatcher
+import query_cache
+import scheduler
+import script_pool
+import spool
+from jobs import write_log
+from startup import LazyModule
+
+# Imported on first use so the service answers sooner after a reboot.
+# ollama_manager pulls in ocr_images (http.client, ctypes, ...) and health
+# imports ollama_manager, so all of them wait; container and script_pool
+# are needed by the job engine right away.
+setup_thinkpad = LazyModule("setup_thinkpad")
+missouri_query = LazyModule("missouri_query")
+health = LazyModule("health")
+ollama_manager = LazyModule("ollama_manager")
+ostree_upgrade = LazyModule("ostree_upgrade")
+transcribe_worker = LazyModule("transcribe_worker")
+webbrowser = LazyModule("webbrowser")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    startup.mark("ready")
+    # Warm the task modules without holding up the first request
+    startup.preload(ollama_manager, health, ostree_upgrade, setup_thinkpad, missouri_query)
+    idle = asyncio.create_task(watch_ollama_idle())
+    # Fork server for kleopatra/nvidia_fix/ostree_upgrade, ready before the first trigger
+    pool = asyncio.create_task(asyncio.to_thread(script_pool.ensure_pool))
+    pool.add_done_callback(report_pool)
+    prestage = asyncio.create_task(prestage_schedule())
+    yield
+    idle.cancel()
+    pool.cancel()
+    prestage.cancel()
+
+
+def report_pool(task):
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"startup: script pool failed: {task.exception()!r}", flush=True)
+    elif not task.result():
+        print("startup: script pool not running, host scripts will run cold", flush=True)
+
+
+async def watch_ollama_idle():
+    # Import off the event loop rather than on the first attribute access
+    await asyncio.to_thread(ollama_manager._load)
+    await ollama_manager.watch_idle(lambda: jobs.busy(*ollama_manager.USERS))
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(startup.FirstResponseTimer)
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+UV = "/var/home/fraser/.cargo/bin/uv"
+
+# Host scripts (kleopatra.py, nvidia_fix.py, ostree_upgrade.py) run from script_pool.py
+NVIDIA_SCRIPT = BASE_DIR / "nvidia_fix.py"
+# Client for the warm worker that keeps batch_transcribe.py's model loaded (stdlib only)
+TRANSCRIBE_SCRIPT = str(BASE_DIR / "transcribe_worker.py")
+
+
+# Container script (run through the container agent, see container.py)
+BACKUP_SCRIPT = str(BASE_DIR / "backup.py")
+MAINTENANCE_SCRIPT = str(BASE_DIR / "restic_maintenance.py")
+MAINTENANCE_STATE = BASE_DIR / "restic_maintenance.json"
+# stdlib only, so plain python3 without uv resolution
+OCR_SCRIPT = str(BASE_DIR / "ocr_images.py")
+
+# Tasks that don't log to BASE_DIR/<task>.log
+LOG_FILES = {
+    "ollama_on": "ollama_manager.log",
+    "ollama_off": "ollama_manager.log",
+}
 
 
 # -----------------------------
 # HELPERS
 # -----------------------------
-def ts():
-    return datetime.now().strftime("%Y-%m-%d %I:%M %p")
-
-def write_log(path, header, stdout, stderr):
-    with open(path, "a") as f:
-        f.write(f"\n=== {header} @ {ts()} ===\n")
-        f.write("STDOUT:\n")
-        f.write(stdout or "")
-        f.write("\nSTDERR:\n")
-        f.write(stderr or "")
-        f.write(f"\n=== END @ {ts()} ===\n")
-
 def open_browser():
     """Open browser after a short delay to ensure server is ready"""
     webbrowser.open('http://127.0.0.1:8000/db2_display')
@@ -51,248 +102,232 @@ def open_browser():
 # BACKUP MODULE
 # -----------------------------
 def run_backup():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/.cargo/bin/uv", "run",
-            BACKUP_SCRIPT
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "backup",
+        [UV, "run", BACKUP_SCRIPT],
+        in_container=True,
+        log_path=BASE_DIR / "backup.log",
+        header="BACKUP TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/backup.log",
-              "BACKUP TRIGGERED", out, err)
+
+
+# -----------------------------
+# RESTIC MAINTENANCE MODULE
+# -----------------------------
+def run_restic_maintenance():
+    return jobs.submit(
+        "restic_maintenance",
+        [UV, "run", MAINTENANCE_SCRIPT],
+        in_container=True,
+        log_path=BASE_DIR / "restic_maintenance.log",
+        header="RESTIC MAINTENANCE TRIGGERED",
+    )
+
+def last_maintenance():
+    if MAINTENANCE_STATE.exists():
+        with MAINTENANCE_STATE.open() as f:
+            return json.load(f).get("last_run")
+    return None
 
 
 # -----------------------------
 # KLEOPATRA MODULE
 # -----------------------------
 def run_kleopatra():
-    p = subprocess.Popen(
-        ["/var/home/fraser/.cargo/bin/uv", "run", str(KLEO_SCRIPT)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "kleopatra",
+        ["kleopatra"],
+        in_pool=True,
+        log_path=BASE_DIR / "kleopatra.log",
+        header="KLEOPATRA TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/kleopatra.log",
-              "KLEOPATRA TRIGGERED", out, err)
 
 
 # -----------------------------
 # NVIDIA FIX MODULE
 # -----------------------------
 def run_nvidia_fix():
-    p = subprocess.Popen(
-        ["/var/home/fraser/.cargo/bin/uv", "run", str(NVIDIA_SCRIPT)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "nvidia_fix",
+        ["nvidia_fix"],
+        in_pool=True,
+        log_path=BASE_DIR / "nvidia_fix.log",
+        header="NVIDIA FIX TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/nvidia_fix.log",
-              "NVIDIA FIX TRIGGERED", out, err)
 
 
 # -----------------------------
 # REBOOT MODULE
 # -----------------------------
 def run_reboot():
-    p = subprocess.Popen(
+    return jobs.submit(
+        "reboot",
         ["systemctl", "reboot"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+        log_path=BASE_DIR / "reboot.log",
+        header="REBOOT TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/reboot.log",
-              "REBOOT TRIGGERED", out, err)
-
 
-def run_ostree_upgrade():
-    log("=== OSTREE UPGRADE TRIGGERED ===")
 
-    upgrade_script = "/var/home/fraser/backup_service/ostree_upgrade.py"
-
-    # Spawn the upgrade script as a separate process
-    result = subprocess.Popen(
-        ["/usr/bin/env", "python3", upgrade_script],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
+# -----------------------------
+# OSTREE UPGRADE MODULE
+# -----------------------------
+def run_ostree_upgrade(fresh=False):
+    # ostree_upgrade.py writes its own ostree_upgrade.log
+    return jobs.submit(
+        "ostree_upgrade",
+        ["ostree_upgrade", "--fresh"] if fresh else ["ostree_upgrade"],
+        in_pool=True,
     )
 
-    log(f"Spawned ostree upgrade script (PID {result.pid})")
-    log("Upgrade will continue in background")
+def run_ostree_prestage():
+    # rpm-ostree upgrade --check / --download-only, cached in ostree_prestage.json
+    return jobs.submit(
+        "ostree_prestage",
+        ["ostree_upgrade", "--prestage"],
+        in_pool=True,
+    )
 
-    return True
+# Prestage when the cached check is older than this; the first one waits
+# PRESTAGE_DELAY after start-up so it doesn't compete with the boot
+PRESTAGE_INTERVAL = 6 * 3600
+PRESTAGE_DELAY = 600
 
+async def prestage_schedule():
+    await asyncio.sleep(PRESTAGE_DELAY)
+    while True:
+        cache = await asyncio.to_thread(ostree_upgrade.load_cache)
+        due = cache.get("checked_ts", 0) + PRESTAGE_INTERVAL - time.time()
+        if due > 0:
+            await asyncio.sleep(due)
+            continue
+        await run_ostree_prestage().done.wait()
+        # A failed check waits for the next interval too
+        await asyncio.sleep(PRESTAGE_INTERVAL)
 
 
 # -----------------------------
 # VSCODE + JUPYTER LABS ON
 # -----------------------------
 def run_vscode_on():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/backup_service/vscode_on.sh"
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "vscode_on",
+        [str(BASE_DIR / "vscode_on.sh")],
+        in_container=True,
+        log_path=BASE_DIR / "vscode_on.log",
+        header="VSCODE + JUPYTER STARTED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/vscode_on.log",
-              "VSCODE + JUPYTER STARTED", out, err)
 
 
 # -----------------------------
 # VSCODE + JUPYTER LABS OFF
 # -----------------------------
 def run_vscode_off():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/backup_service/vscode_off.sh"
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "vscode_off",
+        [str(BASE_DIR / "vscode_off.sh")],
+        in_container=True,
+        log_path=BASE_DIR / "vscode_off.log",
+        header="VSCODE + JUPYTER STOPPED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/vscode_off.log",
-              "VSCODE + JUPYTER STOPPED", out, err)
 
 
 # -----------------------------
 # OLLAMA ON
 # -----------------------------
 def run_ollama_on():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/backup_service/ollama_on.sh"
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/ollama.log",
-              "OLLAMA SERVER STARTED", out, err)
+    # ollama_manager.py writes its own ollama_manager.log; job.result has ready_s/preload_s
+    return jobs.submit("ollama_on", func=ollama_manager.start, on_cancel=ollama_manager.cancel)
 
 # -----------------------------
 # OLLAMA OFF
 # -----------------------------
 def run_ollama_off():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/backup_service/ollama_off.sh"
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/ollama.log",
-              "OLLAMA SERVER STOPPED", out, err)
+    return jobs.submit("ollama_off", func=ollama_manager.stop, on_cancel=ollama_manager.cancel)
 
 # -----------------------------
 # OCR IMAGES
 # -----------------------------
 def run_ocr_images():
-    p = subprocess.Popen(
-        [
-            "distrobox", "enter", CONTAINER_NAME,
-            "--",
-            "/var/home/fraser/backup_service/ocr_images.sh"
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "ocr_images",
+        ["python3", OCR_SCRIPT],
+        in_container=True,
+        log_path=BASE_DIR / "ocr_images.log",
+        header="OCR IMAGES TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/ollama.log",
-              "OCR IMAGES TRIGGERED", out, err)
-    
+
 
 # -----------------------------
 # COHERE TRANSCRIPTION MODULE
 # -----------------------------
 def run_cohere_transcription():
-    p = subprocess.Popen(
-        ["/var/home/fraser/.cargo/bin/uv", "run",  str(COHERE_SCRIPT)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    return jobs.submit(
+        "cohere_transcription",
+        ["python3", TRANSCRIBE_SCRIPT, "submit"],
+        log_path=BASE_DIR / "cohere_transcription.log",
+        header="COHERE TRANSCRIPTION TRIGGERED",
     )
-    out, err = p.communicate()
-    write_log("/var/home/fraser/backup_service/cohere_transcription.log",
-              "COHERE TRANSCRIPTION TRIGGERED", out, err)
+
+
+# -----------------------------
+# GPU HAND-OVER
+# -----------------------------
+# glm-ocr stays in VRAM for KEEP_ALIVE after an OCR run and Cohere for
+# IDLE_RELEASE after a transcription, well past the job's gpu claim. The
+# next gpu job evicts the other one's model before it starts.
+def evict_ollama_models():
+    names = ollama_manager.unload()
+    return f"Unloaded {', '.join(names)} from ollama to free the GPU" if names else None
+
+def evict_transcription_model():
+    if transcribe_worker.release():
+        return "Released the Cohere model to free the GPU"
+    return None
+
+jobs.ON_START.update({
+    "cohere_transcription": evict_ollama_models,
+    "ocr_images": evict_transcription_model,
+    "ollama_on": evict_transcription_model,
+})
+
+
+# -----------------------------
+# SETUP THINKPAD MODULE
+# -----------------------------
+def run_setup_thinkpad():
+    # setup_thinkpad.py writes its own setup_thinkpad.log
+    return jobs.submit("setup_thinkpad", func=setup_thinkpad.run_setup,
+                       on_cancel=setup_thinkpad.cancel)
 
 
 # -----------------------------
 # COBOL DB2 QUERY TEST
 # -----------------------------
+DB2_COLUMNS = ("account_no", "limit", "balance", "surname", "firstname", "comments")
+DB2_CONVERTERS = (str, float, float, str, str, str)
+
 def run_db2_query():
     """Query DB2 via COBOL program and return JSON"""
     try:
-        # Submit job and get output
-        result = subprocess.run([
-            "zowe", "jobs", "submit", "ds", "Z89165.JCL(CBLDB21)",
-            "--view-all-spool-content"
-        ], capture_output=True, text=True, check=True)
-
-        # Extract PIPEOUT section
-        output = result.stdout
-        start = output.find("Spool file: PIPEOUT")
-        end = output.find("Spool file: SYSTSPRT")
-
-        if start == -1 or end == -1:
-            write_log("/var/home/fraser/backup_service/db2.log",
-                     "DB2 QUERY FAILED", output[:500], "PIPEOUT spool not found")
-            return None
-
-        # Get pipe-delimited content
-        pipe_section = output[start:end]
-        lines = pipe_section.split('\n')[1:]  # Skip "Spool file:" header
-
-        # Parse each line
-        records = []
-        for line in lines:
-            line = line.strip()
-            if not line or '|' not in line:
-                continue
-
-            parts = line.split('|')
-            if len(parts) >= 6:
-                records.append({
-                    "account_no": parts[0].strip(),
-                    "limit": float(parts[1].strip()),
-                    "balance": float(parts[2].strip()),
-                    "surname": parts[3].strip(),
-                    "firstname": parts[4].strip(),
-                    "comments": parts[5].strip()
-                })
-
-        result_json = json.dumps(records)
-        write_log("/var/home/fraser/backup_service/db2.log",
-                 "DB2 QUERY SUCCESS", f"Loaded {len(records)} records", "")
-
-        return result_json
+        rows = spool.query("Z89165.JCL(CBLDB21)", DB2_COLUMNS, DB2_CONVERTERS)
+        write_log(BASE_DIR / "db2.log",
+                  "DB2 QUERY SUCCESS", f"Loaded {len(rows)} records", "")
+        return rows.to_json()
+
+    except spool.SpoolError as e:
+        write_log(BASE_DIR / "db2.log",
+                  "DB2 QUERY FAILED", "", str(e))
+        return None
+
+    except subprocess.TimeoutExpired as e:
+        write_log(BASE_DIR / "db2.log",
+                  "DB2 QUERY TIMED OUT", "", f"zowe killed after {e.timeout}s")
+        return None
 
     except Exception as e:
         import traceback
-        write_log("/var/home/fraser/backup_service/db2.log",
-                 "DB2 QUERY ERROR", traceback.format_exc(), str(e))
+        write_log(BASE_DIR / "db2.log",
+                  "DB2 QUERY ERROR", traceback.format_exc(), str(e))
         return None
 
 
@@ -301,108 +336,277 @@ def run_db2_query():
 # -----------------------------
 # FASTAPI ROUTES
 # -----------------------------
+def started(status, job):
+    # coalesced: this trigger attached to a run that was already queued/running
+    return {"status": status, "job_id": job.id, "coalesced": job.triggers > 1}
+
 @app.post("/backup")
-def trigger_backup(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_backup)
-    return {"status": "backup_started"}
+async def trigger_backup():
+    return started("backup_started", run_backup())
+
+@app.post("/restic_maintenance")
+async def trigger_restic_maintenance(if_idle: bool = False, min_days: float = 0):
+    """forget --prune + rotating check. The nightly timer passes if_idle/min_days
+    so maintenance only runs when nothing else is going on and is due."""
+    if if_idle and jobs.busy():
+        return {"status": "skipped_busy"}
+    last = await asyncio.to_thread(last_maintenance)
+    if min_days and last:
+        age = datetime.now() - datetime.fromisoformat(last["finished"])
+        if age.total_seconds() < min_days * 86400:
+            return {"status": "skipped_not_due", "last_run": last["finished"]}
+    return started("restic_maintenance_started", run_restic_maintenance())
+
+@app.get("/restic_maintenance")
+def restic_maintenance_report():
+    """Last maintenance report: duration, reclaimed bytes, check subset per repo."""
+    return last_maintenance() or {"status": "never_run"}
 
 @app.post("/kleopatra")
-def trigger_kleopatra(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_kleopatra)
-    return {"status": "kleopatra_started"}
+async def trigger_kleopatra():
+    return started("kleopatra_started", run_kleopatra())
 
 @app.post("/nvidia_fix")
-def trigger_nvidia_fix(background_tasks: BackgroundTasks):
+async def trigger_nvidia_fix():
     if not NVIDIA_SCRIPT.exists():
         return {"status": "error", "message": "nvidia_fix.py not found"}
 
-    background_tasks.add_task(run_nvidia_fix)
-    return {"status": "nvidia_fix_started", "message": "System will reboot shortly."}
+    return {**started("nvidia_fix_started", run_nvidia_fix()),
+            "message": "System will reboot shortly."}
 
 @app.post("/reboot")
-def trigger_reboot(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_reboot)
-    return {"status": "reboot_started"}
+async def trigger_reboot():
+    return started("reboot_started", run_reboot())
 
 @app.post("/ostree_upgrade")
-def trigger_ostree_upgrade(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_ostree_upgrade)
-    return {"status": "upgrade_started"}
+async def trigger_ostree_upgrade(fresh: bool = False):
+    """Stage the upgrade the prestage downloaded; answered from its cache when there's nothing to do."""
+    cache = await asyncio.to_thread(ostree_upgrade.load_cache)
+    state = None if fresh else ostree_upgrade.cached_state(cache)
+    if state == "up_to_date":
+        return {"status": "up_to_date", "checked": cache["checked"]}
+    if state == "staged":
+        return {"status": "already_staged", "version": cache["staged"]["version"],
+                "message": "Reboot to apply."}
+    return started("upgrade_started", run_ostree_upgrade(fresh))
+
+@app.post("/ostree_prestage")
+async def trigger_ostree_prestage():
+    return started("ostree_prestage_started", run_ostree_prestage())
+
+@app.get("/ostree_prestage")
+def ostree_prestage_state():
+    """Last check: update available, downloaded, staged deployment."""
+    return ostree_upgrade.load_cache() or {"status": "never_run"}
 
 @app.post("/vscode_on")
-def trigger_vscode_on(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_vscode_on)
-    return {"status": "vscode_on_started"}
+async def trigger_vscode_on():
+    return started("vscode_on_started", run_vscode_on())
 
 @app.post("/vscode_off")
-def trigger_vscode_off(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_vscode_off)
-    return {"status": "vscode_off_started"}
+async def trigger_vscode_off():
+    return started("vscode_off_started", run_vscode_off())
 
 @app.post("/ollama_on")
-def trigger_ollama_on(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_ollama_on)
-    return {"status": "ollama_on_started"}
+async def trigger_ollama_on():
+    return started("ollama_on_started", run_ollama_on())
 
 @app.post("/ollama_off")
-def trigger_ollama_off(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_ollama_off)
-    return {"status": "ollama_off_started"}
+async def trigger_ollama_off():
+    return started("ollama_off_started", run_ollama_off())
+
+@app.get("/ollama_status")
+async def ollama_status():
+    """Server up/version, models loaded in VRAM, seconds since last OCR activity."""
+    return await asyncio.to_thread(ollama_manager.status)
 
 @app.post("/ocr_images")
-def trigger_ocr_images(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_ocr_images)
-    return {"status": "ocr_images_started"}
+async def trigger_ocr_images():
+    return started("ocr_images_started", run_ocr_images())
 
 @app.post("/cohere_transcription")
-def trigger_cohere_transcription(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_cohere_transcription)
-    return {"status": "cohere_transcription_started"}
+async def trigger_cohere_transcription():
+    return started("cohere_transcription_started", run_cohere_transcription())
+
+# -----------------------------
+# JOBS
+# -----------------------------
+@app.get("/jobs")
+def list_jobs(task: str | None = None):
+    return jobs.list_jobs(task)
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Kill a running job's process group (SIGTERM, then SIGKILL) or drop it from the queue."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    if not jobs.cancel(job):
+        return {"status": "not_active", "job_id": job.id, "state": job.state}
+    return {"status": "cancelling", "job_id": job.id, "state": job.state}
+
+@app.get("/jobs/{job_id}/stream")
+def stream_job(job_id: str, request: Request):
+    """Live job output as Server-Sent Events (resumable via Last-Event-ID)."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    since = int(request.headers.get("last-event-id") or 0)
+    return StreamingResponse(
+        jobs.stream_events(job, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -----------------------------
+# LOGS
+# -----------------------------
+def read_logs(task, last, lines):
+    path = BASE_DIR / LOG_FILES.get(task, f"{task}.log")
+    runs = logstore.last_runs(path, last, task)
+    if runs is not None:
+        return {"task": task, "log": path.name, "runs": runs}
+    if not path.exists():
+        return None
+    # Scripts that keep their own timestamped log have no run index
+    return {"task": task, "log": path.name, "lines": logstore.tail_lines(path, lines)}
+
+@app.get("/logs/{task}")
+async def get_logs(task: str, last: int = 1, lines: int = 200):
+    """The last N runs of a task from its log index (older runs are read from the .gz segments)."""
+    if not task.replace("_", "").isalnum():
+        raise HTTPException(status_code=400, detail="Bad task name")
+    result = await asyncio.to_thread(read_logs, task, max(last, 1), max(lines, 1))
+    if result is None:
+        raise HTTPException(status_code=404, detail="No log for this task")
+    return result
+
+@app.get("/health")
+async def health_check(refresh: bool = False):
+    """GPU, kernel args, YubiKey and helper status in milliseconds.
+
+    nvidia-smi and gpg --card-status results come from a cache; refresh=true
+    re-runs them in the background for the next call.
+    """
+    return health.check(refresh)
+
+@app.get("/scheduler")
+def scheduler_state():
+    """Resource classes: limits, which jobs hold them, who is waiting, learned run times."""
+    return scheduler.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus scrape: job queue wait, spawn latency, run time, exit codes, output bytes."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # -----------------------------
 # SETUP THINKPAD
 # -----------------------------
 @app.post("/setup_thinkpad")
-def trigger_setup_thinkpad(background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_setup)
-    return {"status": "setup_thinkpad_started"}
+async def trigger_setup_thinkpad():
+    return started("setup_thinkpad_started", run_setup_thinkpad())
 
 @app.get("/setup_thinkpad_status")
 def setup_thinkpad_status():
-    return load_status()
+    return setup_thinkpad.load_status()
+
+@app.get("/setup_thinkpad_events")
+async def setup_thinkpad_events():
+    """Server-Sent Events: the full status now and again after every change."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=1)
+
+    async def events():
+        setup_thinkpad.subscribe(loop, queue)
+        try:
+            yield f"data: {json.dumps(setup_thinkpad.load_status())}\n\n"
+            while True:
+                try:
+                    status = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # keeps tailscale serve / mobile proxies from idling out
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(status)}\n\n"
+        finally:
+            setup_thinkpad.unsubscribe(loop, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/setup_thinkpad_reset")
 def setup_thinkpad_reset():
-    status = new_status()
-    save_status(status)
+    status = setup_thinkpad.new_status()
+    setup_thinkpad.save_status(status)
     return status
 
 @app.get("/setup_thinkpad", response_class=HTMLResponse)
-def setup_thinkpad_page():
-    with open("/var/home/fraser/backup_service/templates/setup_thinkpad.html") as f:
-        return f.read()
+async def setup_thinkpad_page(request: Request):
+    return await page_cache.page(request, "setup_thinkpad.html")
 
 # -----------------------------
 # COBOL DB2
 # -----------------------------
-@app.get("/test_db2")
-def test_db2():
-    """Query DB2 and return JSON results"""
-    json_data = run_db2_query()
-
-    if json_data is None:
-        return {"status": "error", "message": "Failed to query DB2"}
+# Interactive: ahead of queued mainframe jobs, if any
+MAINFRAME_PRIORITY = 10
+
+def mainframe_slot(name):
+    """Scheduler slot on the "mainframe" class, held while a zowe job runs."""
+    return scheduler.hold(("mainframe",), name, priority=MAINFRAME_PRIORITY)
+
+async def on_mainframe(name, fn, *args):
+    async with mainframe_slot(name):
+        return await asyncio.to_thread(fn, *args)
+
+def json_loader(fn, *args):
+    """Wrap a run_*_query function (returns a JSON string or None) for query_cache."""
+    async def load():
+        json_data = await on_mainframe(fn.__name__, fn, *args)
+        return None if json_data is None else json.loads(json_data)
+    return load
+
+# Concurrent /missouri_select requests within this window share one JCL job
+MISSOURI_BATCH_WINDOW = 0.25
+select_batcher = MicroBatcher(
+    lambda ids: missouri_query.run_missouri_select(ids), window=MISSOURI_BATCH_WINDOW,
+    gate=lambda: mainframe_slot("run_missouri_select"))
+
+def invalidate_missouri(record_id):
+    """Forget cached Missouri results that can contain record_id."""
+    def affected(key):
+        if key == "missouri:all":
+            return True
+        if key.startswith("missouri:select:"):
+            return record_id in key.split(":", 2)[2].split(",")
+        return False
+    query_cache.invalidate(affected)
 
+@app.get("/test_db2")
+async def test_db2(fresh: bool = False):
+    """Query DB2 and return JSON results (cached, see query_cache.py)"""
     try:
-        import json
-        return json.loads(json_data)
+        data = await query_cache.get("db2", json_loader(run_db2_query), fresh=fresh)
     except json.JSONDecodeError as e:
         return {"status": "error", "message": f"Invalid JSON: {str(e)}"}
 
+    if data is None:
+        return {"status": "error", "message": "Failed to query DB2"}
+    return data
+
 @app.get("/db2_display", response_class=HTMLResponse)
-def db2_display():
-    with open("/var/home/fraser/backup_service/templates/db2_display.html") as f:
-        return f.read()
+async def db2_display(request: Request):
+    return await page_cache.page(request, "db2_display.html")
 
 @app.get("/trigger_db2")
 def trigger_db2(background_tasks: BackgroundTasks):
@@ -414,9 +618,8 @@ def trigger_db2(background_tasks: BackgroundTasks):
 
 # Lab 9.2: Missouri Employment data db2 ###########################################
 @app.get("/missouri_main", response_class=HTMLResponse)
-def missouri_main():
-    with open("/var/home/fraser/backup_service/templates/missouri_main.html") as f:
-        return f.read()
+async def missouri_main(request: Request):
+    return await page_cache.page(request, "missouri_main.html")
 
 @app.get("/trigger_missouri_main")
 def trigger_missouri_select(background_tasks: BackgroundTasks):
@@ -425,23 +628,39 @@ def trigger_missouri_select(background_tasks: BackgroundTasks):
 
 
 @app.post("/missouri_select")
-def missouri_select(request_body: dict):
+async def missouri_select(request_body: dict):
     """Query specific RECORDID(s). Expects JSON: {"record_ids": ["08012011", "07012011"]}"""
     ids = request_body.get("record_ids", [])
     if not ids:
         return {"status": "error", "message": "No record_ids provided"}
-    json_data = run_missouri_select(ids)
-    if json_data is None:
-        return {"status": "error", "message": "Failed to query Missouri data"}
+    if not isinstance(ids, list) or not all(
+            isinstance(i, (str, int)) and not isinstance(i, bool) for i in ids):
+        return {"status": "error", "message": "record_ids must be a list of strings or numbers"}
+    # 8012011 and "8012011" are the same record (and the same cache entry)
+    ids = [str(i).strip() for i in ids]
+    if not all(ids):
+        return {"status": "error", "message": "Empty record_id"}
+    key = "missouri:select:" + ",".join(sorted(set(ids)))
+
+    async def load():
+        return await select_batcher.submit(ids)
+
     try:
-        return json.loads(json_data)
+        data = await query_cache.get(key, load)
     except json.JSONDecodeError as e:
         return {"status": "error", "message": f"Invalid JSON: {str(e)}"}
+    if data is None:
+        return {"status": "error", "message": "Failed to query Missouri data"}
+    return data
+
+@app.get("/missouri_select_stats")
+def missouri_select_stats():
+    """Micro-batching stats for /missouri_select (batch sizes, wait times)."""
+    return select_batcher.stats()
 
 @app.get("/missouri_select_display", response_class=HTMLResponse)
-def missouri_select_display():
-    with open("/var/home/fraser/backup_service/templates/missouri_select.html") as f:
-        return f.read()
+async def missouri_select_display(request: Request):
+    return await page_cache.page(request, "missouri_select.html")
 
 @app.get("/trigger_missouri_select")
 def trigger_missouri_select(background_tasks: BackgroundTasks):
@@ -450,20 +669,19 @@ def trigger_missouri_select(background_tasks: BackgroundTasks):
 
 
 @app.get("/missouri_data")
-def missouri_data():
+async def missouri_data(fresh: bool = False):
     """Query Missouri unemployment data and return JSON results"""
-    json_data = run_missouri_query()
-    if json_data is None:
-        return {"status": "error", "message": "Failed to query Missouri data"}
     try:
-        return json.loads(json_data)
+        data = await query_cache.get("missouri:all", json_loader(missouri_query.run_missouri_query), fresh=fresh)
     except json.JSONDecodeError as e:
         return {"status": "error", "message": f"Invalid JSON: {str(e)}"}
+    if data is None:
+        return {"status": "error", "message": "Failed to query Missouri data"}
+    return data
 
 @app.get("/missouri_display", response_class=HTMLResponse)
-def missouri_display():
-    with open("/var/home/fraser/backup_service/templates/missouri_display.html") as f:
-        return f.read()
+async def missouri_display(request: Request):
+    return await page_cache.page(request, "missouri_display.html")
 
 @app.get("/trigger_missouri")
 def trigger_missouri(background_tasks: BackgroundTasks):
@@ -471,12 +689,13 @@ def trigger_missouri(background_tasks: BackgroundTasks):
     return RedirectResponse(url="/missouri_display")
 
 @app.post("/missouri_update")
-def missouri_update(request_body: dict):
+async def missouri_update(request_body: dict):
     """Update a RECORDID. Expects JSON: {"record_id": "09012011", "ethnicity": {...}, "age": {...}, ...}"""
     record_id = request_body.get("record_id", "")
     if not record_id:
         return {"status": "error", "message": "No record_id provided"}
-    result = run_missouri_update(record_id, request_body)
+    result = await on_mainframe("run_missouri_update", missouri_query.run_missouri_update, record_id, request_body)
+    invalidate_missouri(record_id)
     if result is None:
         return {"status": "error", "message": "Failed to update record"}
     return result
@@ -487,24 +706,28 @@ async def missouri_insert(request: Request):
     record_id = request_body.get("record_id", "")
     if not record_id:
         return {"status": "error", "message": "No record_id provided"}
-    result = run_missouri_insert(record_id, request_body)
+    result = await on_mainframe("run_missouri_insert", missouri_query.run_missouri_insert, record_id, request_body)
+    invalidate_missouri(record_id)
     if result is None:
         return {"status": "error", "message": "Failed to insert record"}
     return result
 
 @app.get("/missouri_add", response_class=HTMLResponse)
-def missouri_add():
-    with open("/var/home/fraser/backup_service/templates/missouri_add.html") as f:
-        return f.read()
+async def missouri_add(request: Request):
+    return await page_cache.page(request, "missouri_add.html")
 
 
 @app.post("/missouri_delete")
-def missouri_delete(request_body: dict):
+async def missouri_delete(request_body: dict):
     """Delete a RECORDID from all 5 tables. Expects JSON: {"record_id": "08012011"}"""
     record_id = request_body.get("record_id", "")
     if not record_id:
         return {"status": "error", "message": "No record_id provided"}
-    result = run_missouri_delete(record_id)
+    result = await on_mainframe("run_missouri_delete", missouri_query.run_missouri_delete, record_id)
+    invalidate_missouri(record_id)
     if result is None:
         return {"status": "error", "message": "Failed to delete record"}
     return result
+
+
+startup.mark("imported")
@@ -0,0 +1,106 @@
+"""Minimal Prometheus text-format metrics (no client library needed).
+
+Scrape GET /metrics. Everything is labelled by task so a slower restic run
+after an ostree upgrade shows up as a shift in backup_service_job_run_seconds.
+"""
+import threading
+
+# Seconds; jobs range from sub-second toggles to hour-long backups
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_registry = []
+_collectors = []
+_lock = threading.Lock()
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, v in self._values.items():
+            yield self.name + _fmt_labels(self.labels, labels), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, labels, value):
+        with _lock:
+            v = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def samples(self):
+        for labels, v in self._values.items():
+            for bound, n in zip(self.buckets, v):
+                yield self.name + "_bucket" + _fmt_labels(self.labels, labels, [("le", bound)]), n
+            yield self.name + "_bucket" + _fmt_labels(self.labels, labels, [("le", "+Inf")]), v[-1]
+            yield self.name + "_sum" + _fmt_labels(self.labels, labels), round(v[-2], 6)
+            yield self.name + "_count" + _fmt_labels(self.labels, labels), v[-1]
+
+
+def collector(fn):
+    """Register fn() -> [(name, help, kind, label_names, {label_values: value})] for scrape-time gauges."""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = []
+    with _lock:
+        for m in _registry:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(f"{k} {v}" for k, v in m.samples())
+    for fn in _collectors:
+        for name, help, kind, label_names, values in fn():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_fmt_labels(label_names, k)} {v}" for k, v in values.items())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# JOB + QUERY METRICS
+# -----------------------------
+JOB_QUEUE_WAIT = Histogram(
+    "backup_service_job_queue_wait_seconds", "Time from trigger to job start", ["task"])
+JOB_SPAWN = Histogram(
+    "backup_service_job_spawn_seconds", "Time to start the child process (host or container agent)", ["task"])
+JOB_RUN = Histogram(
+    "backup_service_job_run_seconds", "Job run time from start to exit", ["task"])
+JOB_EXITS = Counter(
+    "backup_service_job_exits_total", "Finished jobs by exit code", ["task", "code"])
+JOB_OUTPUT_BYTES = Counter(
+    "backup_service_job_output_bytes_total", "Bytes of stdout+stderr produced by jobs", ["task"])
+QUERY_SECONDS = Histogram(
+    "backup_service_zowe_query_seconds", "zowe job submit + spool parse time", ["jcl", "outcome"])
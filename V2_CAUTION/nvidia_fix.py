@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import subprocess
+import sys
 from datetime import datetime
 from pathlib import Path
 
+import logstore
+
 BASE_DIR = Path("/var/home/fraser/backup_service")
 LOG_FILE = BASE_DIR / "nvidia_fix.log"
 
@@ -13,8 +16,7 @@ REQUIRED_ARGS = [
 
 def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with LOG_FILE.open("a") as f:
-        f.write(f"{timestamp} {msg}\n")
+    logstore.append_line(LOG_FILE, f"{timestamp} {msg}")
     print(msg)
 
 def run(cmd):
@@ -37,7 +39,7 @@ def main():
     result = run(["rpm-ostree", "kargs"])
     if result.returncode != 0:
         log("ERROR: Could not read kernel args")
-        return
+        return False
 
     current_args = result.stdout.strip().split()
     log(f"Current kernel args:\n{' '.join(current_args)}")
@@ -58,9 +60,10 @@ def main():
     result = run(cmd)
     if result.returncode != 0:
         log("ERROR: Failed to update kernel args")
-        return
+        return False
 
     log("=== NVIDIA FIX COMPLETED ===")
+    return True
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# OCR every image in Pictures/orc_this through the ollama HTTP API.
+# This script runs INSIDE fedora42-nvidia (like backup.py), triggered by
+# POST /ocr_images. Up to CONCURRENCY images are in flight at once over
+# keep-alive connections, the model stays loaded for KEEP_ALIVE between
+# requests, and each .md is written atomically next to its image.
+#
+# Only new or changed images are sent: MANIFEST_NAME in the folder records
+# size, mtime and sha256 of every image OCR'd with which model and prompt.
+# --watch keeps running and OCRs images as they land (inotify).
+import argparse
+import base64
+import ctypes
+import hashlib
+import http.client
+import json
+import os
+import queue
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlsplit
+
+OCR_DIR = Path("/var/home/fraser/Pictures/orc_this")
+OLLAMA_ON = Path("/var/home/fraser/backup_service/ollama_on.sh")
+MODEL = "glm-ocr"
+PROMPT = "Text Recognition:"
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp")
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+# ollama answers OLLAMA_NUM_PARALLEL requests per model at once; more just queue there
+CONCURRENCY = 2
+KEEP_ALIVE = "15m"
+REQUEST_TIMEOUT = 600
+START_TIMEOUT = 30
+
+MANIFEST_NAME = ".ocr_manifest.json"
+# watch mode: wait for this long without new events before starting a batch
+WATCH_SETTLE = 1.0
+WATCH_POLL = 5.0
+
+
+def log(msg):
+    print(f"[ocr_images] {msg}", flush=True)
+
+
+# -----------------------------
+# OLLAMA CLIENT
+# -----------------------------
+class _Connection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        # headers and the base64 body go out in separate writes; don't wait on delayed ACKs
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class OllamaPool:
+    """Keep-alive HTTP connections to the ollama server, reused across requests."""
+
+    def __init__(self, host=OLLAMA_HOST, timeout=REQUEST_TIMEOUT):
+        url = urlsplit(host if "://" in host else f"http://{host}")
+        self.host = url.hostname or "127.0.0.1"
+        if self.host == "0.0.0.0":
+            self.host = "127.0.0.1"
+        self.port = url.port or 11434
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def _connection(self):
+        """(connection, reused). Idle sockets the server has since closed are dropped."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return _Connection(self.host, self.port, timeout=self.timeout), False
+            # Readable while idle means EOF (or junk): the server closed the keep-alive
+            if conn.sock is not None and not select.select([conn.sock], [], [], 0)[0]:
+                return conn, True
+            conn.close()
+
+    def request(self, method, path, body=None, timeout=None):
+        """JSON request -> (status, decoded body).
+
+        Only a reused connection that fails while the request is being written is
+        retried, on a fresh one. Once a request is out it is never resent, so a slow
+        /api/generate can't run twice.
+        """
+        payload = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if payload else {}
+        timeout = timeout or self.timeout
+        while True:
+            conn, reused = self._connection()
+            # http.client applies .timeout only when it connects; a pooled socket
+            # would keep whatever timeout the request that opened it had
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                if reused and not isinstance(e, TimeoutError):
+                    continue
+                raise
+            try:
+                resp = conn.getresponse()
+                data = resp.read()
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return resp.status, json.loads(data) if data else {}
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+def server_up(pool):
+    try:
+        status, _ = pool.request("GET", "/api/version", timeout=2)
+        return status == 200
+    except (OSError, http.client.HTTPException, ValueError):
+        return False
+
+
+def ensure_server(pool):
+    if server_up(pool):
+        return True
+    log("Ollama not running, starting it...")
+    subprocess.run([str(OLLAMA_ON)], check=False)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server_up(pool):
+            log("Ollama server is ready.")
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def ocr(pool, image, model=MODEL, prompt=PROMPT, keep_alive=KEEP_ALIVE):
+    status, reply = pool.request("POST", "/api/generate", {
+        "model": model,
+        "prompt": prompt,
+        "images": [base64.b64encode(image.read_bytes()).decode()],
+        "stream": False,
+        "keep_alive": keep_alive,
+    })
+    if status != 200:
+        raise RuntimeError(f"ollama returned {status}: {reply.get('error', reply)}")
+    return reply.get("response", "").strip()
+
+
+# -----------------------------
+# PIPELINE
+# -----------------------------
+def write_atomic(path, text):
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text + "\n")
+    os.replace(tmp, path)
+
+
+def find_images(folder):
+    return sorted(p for p in folder.iterdir()
+                  if p.suffix.lower() in EXTENSIONS and p.is_file())
+
+
+def process(pool, image, model, prompt, keep_alive):
+    text = ocr(pool, image, model, prompt, keep_alive)
+    if not text:
+        raise RuntimeError("empty response")
+    md_file = image.with_suffix(".md")
+    write_atomic(md_file, text)
+    return md_file
+
+
+def run(images, pool, model=MODEL, prompt=PROMPT, concurrency=CONCURRENCY,
+        keep_alive=KEEP_ALIVE, on_done=None):
+    """OCR images with up to `concurrency` requests in flight. Returns a summary dict.
+
+    on_done(image) is called from this thread after each successful .md write.
+    """
+    count = errors = 0
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(process, pool, img, model, prompt, keep_alive): img
+            for img in images
+        }
+        for future in as_completed(futures):
+            img = futures[future]
+            try:
+                md_file = future.result()
+            except Exception as e:
+                log(f"ERROR processing {img.name}: {e}")
+                errors += 1
+            else:
+                log(f"{img.name} -> {md_file.name}")
+                count += 1
+                if on_done is not None:
+                    on_done(img)
+    elapsed = time.monotonic() - t0
+    return {
+        "processed": count,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "images_per_s": round(count / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+# -----------------------------
+# INCREMENTAL (MANIFEST)
+# -----------------------------
+def file_hash(path):
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """What has been OCR'd in a folder: image name -> size, mtime, sha256, model, prompt."""
+
+    def __init__(self, folder):
+        self.path = folder / MANIFEST_NAME
+        self.dirty = False
+        self.images = {}
+        if self.path.exists():
+            try:
+                self.images = json.loads(self.path.read_text()).get("images", {})
+            except ValueError:
+                log(f"WARNING: ignoring unreadable {self.path.name}")
+        self._pending = {}
+
+    def needs_ocr(self, image, model, prompt, force=False):
+        """Cheap size+mtime check first; the file is only hashed when those changed."""
+        st = image.stat()
+        entry = self.images.get(image.name)
+        up_to_date = (
+            not force
+            and entry is not None
+            and entry["model"] == model
+            and entry["prompt"] == prompt
+            and image.with_suffix(".md").exists()
+        )
+        if up_to_date and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return False
+        digest = file_hash(image)
+        if up_to_date and entry["sha256"] == digest:
+            # touched or copied back, same content
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            self.dirty = True
+            return False
+        self._pending[image.name] = {
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest,
+            "model": model, "prompt": prompt,
+        }
+        return True
+
+    def done(self, image):
+        self.images[image.name] = self._pending.pop(image.name)
+        self.dirty = True
+
+    def start_pass(self, images):
+        """Forget images that were deleted and pending entries from failed OCRs."""
+        self._pending.clear()
+        names = {img.name for img in images}
+        for name in [n for n in self.images if n not in names]:
+            del self.images[name]
+            self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            write_atomic(self.path, json.dumps({"images": self.images}, indent=1))
+            self.dirty = False
+
+
+def ocr_folder(folder, pool, args, manifest):
+    """One incremental pass over folder. Returns the run summary (with "skipped")."""
+    images = find_images(folder)
+    manifest.start_pass(images)
+    todo = [img for img in images
+            if manifest.needs_ocr(img, args.model, args.prompt, force=args.all)]
+    summary = {"processed": 0, "errors": 0, "seconds": 0, "images_per_s": None}
+    if todo:
+        if not ensure_server(pool):
+            log("ERROR: Failed to start ollama server.")
+            summary["errors"] = len(todo)
+            return {**summary, "skipped": len(images) - len(todo)}
+        summary = run(todo, pool, args.model, args.prompt, args.concurrency,
+                      args.keep_alive, on_done=manifest.done)
+    manifest.save()
+    return {**summary, "skipped": len(images) - len(todo)}
+
+
+def report(summary):
+    log(f"Done. Processed: {summary['processed']}, Errors: {summary['errors']}, "
+        f"Unchanged: {summary['skipped']} in {summary['seconds']}s "
+        f"({summary['images_per_s'] or 0} images/s)")
+
+
+# -----------------------------
+# WATCH MODE
+# -----------------------------
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Directory watch via the inotify syscalls (ctypes, no extra packages)."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {folder} failed")
+
+    def read(self, timeout):
+        """Names of files written or moved in within timeout seconds ([] on timeout)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        names, offset = [], 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+
+def watch(folder, pool, args, manifest):
+    try:
+        events = Inotify(folder)
+    except (OSError, AttributeError) as e:
+        log(f"inotify unavailable ({e}), polling every {WATCH_POLL}s")
+        events = None
+    log(f"Watching {folder}")
+    while True:
+        if events is None:
+            time.sleep(WATCH_POLL)
+        else:
+            names = events.read(None)
+            if not any(Path(n).suffix.lower() in EXTENSIONS for n in names):
+                continue
+            # let a burst of copies settle into one batch
+            while events.read(WATCH_SETTLE):
+                pass
+        summary = ocr_folder(folder, pool, args, manifest)
+        if summary["processed"] or summary["errors"]:
+            report(summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OCR images through the ollama HTTP API")
+    parser.add_argument("--dir", type=Path, default=OCR_DIR)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--prompt", default=PROMPT)
+    parser.add_argument("--host", default=OLLAMA_HOST)
+    parser.add_argument("-j", "--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE)
+    parser.add_argument("--all", action="store_true", help="re-OCR unchanged images too")
+    parser.add_argument("--watch", action="store_true", help="keep running, OCR new images as they land")
+    args = parser.parse_args(argv)
+
+    log(f"Starting OCR on images in {args.dir}")
+    if not args.dir.is_dir():
+        log(f"ERROR: Cannot open {args.dir}")
+        return False
+    pool = OllamaPool(args.host)
+    manifest = Manifest(args.dir)
+
+    summary = ocr_folder(args.dir, pool, args, manifest)
+    report(summary)
+    if args.watch:
+        try:
+            watch(args.dir, pool, args, manifest)
+        except KeyboardInterrupt:
+            pass
+    pool.close()
+    return summary["errors"] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
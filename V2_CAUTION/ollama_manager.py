@@ -0,0 +1,281 @@
+"""ollama lifecycle: start/stop with real readiness checks, model preload, idle unload.
+
+The container shares the host network, so the service talks to ollama's HTTP
+API directly: readiness is GET /api/version answering, "loaded" means the model
+is listed by GET /api/ps. start() and stop() return their timings, which become
+job.result for /ollama_on and /ollama_off; cancel() (the jobs' on_cancel hook)
+makes a running start() or stop() give up at its next step. watch_idle() unloads MODEL after
+IDLE_UNLOAD seconds without use so transcription gets the VRAM back, and stops
+the server after IDLE_STOP with no model loaded -- but only a server start()
+launched. Use counts OCR jobs and anyone else's requests, which ollama reports
+through /api/ps expires_at; models and servers started by hand are left alone.
+"""
+import asyncio
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+import container
+import logstore
+from ocr_images import KEEP_ALIVE, MODEL, OllamaPool
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+LOG_FILE = BASE_DIR / "ollama_manager.log"
+ON_SCRIPT = BASE_DIR / "ollama_on.sh"
+OFF_SCRIPT = BASE_DIR / "ollama_off.sh"
+
+START_TIMEOUT = 30
+STOP_TIMEOUT = 15
+POLL = 0.05
+# Probes (readiness, /api/ps) give up fast; preload/unload can take minutes
+PROBE_TIMEOUT = 2
+REQUEST_TIMEOUT = 300
+# Load MODEL into VRAM on /ollama_on so the first OCR request doesn't wait for it
+PRELOAD = True
+# Seconds without use before unloading MODEL / stopping the server (None = never)
+IDLE_UNLOAD = 300
+IDLE_STOP = 1800
+IDLE_CHECK = 60
+# Tasks that count as ollama activity for the idle timer
+USERS = ("ocr_images", "ollama_on")
+
+_pool = OllamaPool(timeout=REQUEST_TIMEOUT)
+# time.time() of the last ollama job here, and of the last idle check that saw any
+# model loaded; None until it happens
+_last_used = None
+_resident_at = None
+# True while the running server is one start() launched
+_started = False
+_lock = threading.Lock()
+_cancel = threading.Event()
+_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-preload")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def log(msg):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    line = f"{timestamp} {msg}"
+    logstore.append_line(LOG_FILE, line)
+    print(line)
+
+
+def touch():
+    global _last_used
+    _last_used = time.time()
+
+
+def idle_for():
+    """Seconds since the last ollama job here, None before the first."""
+    return None if _last_used is None else time.time() - _last_used
+
+
+def _seconds(duration):
+    """ollama keep_alive ("15m", "1h", "30s" or plain seconds) in seconds."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    if isinstance(duration, str) and duration[-1:] in units:
+        return float(duration[:-1]) * units[duration[-1]]
+    return float(duration)
+
+
+def _is_model(m, model=MODEL):
+    return m.get("name", "").split(":")[0] == model.split(":")[0]
+
+
+def _used_at(m):
+    """When m was last used; ollama sets expires_at to the last request plus its keep-alive.
+
+    Assumes KEEP_ALIVE, so a request made by hand with a longer keep-alive only
+    makes the model look more recently used.
+    """
+    try:
+        expires = datetime.fromisoformat(m["expires_at"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+    return expires - _seconds(KEEP_ALIVE)
+
+
+# -----------------------------
+# API PROBES
+# -----------------------------
+def version():
+    """Server version, or None if ollama isn't answering."""
+    try:
+        status, body = _pool.request("GET", "/api/version", timeout=PROBE_TIMEOUT)
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    return body.get("version") if status == 200 else None
+
+
+def loaded_models():
+    try:
+        status, body = _pool.request("GET", "/api/ps", timeout=PROBE_TIMEOUT)
+    except (OSError, ValueError, http.client.HTTPException):
+        return []
+    return body.get("models", []) if status == 200 else []
+
+
+def wait_until(check, timeout):
+    """Poll check() every POLL seconds; returns seconds taken or None on timeout."""
+    t0 = time.monotonic()
+    while True:
+        if check():
+            return round(time.monotonic() - t0, 3)
+        if time.monotonic() - t0 > timeout:
+            return None
+        if _cancel.wait(POLL):
+            raise Cancelled("cancelled")
+
+
+def _checkpoint():
+    if _cancel.is_set():
+        raise Cancelled("cancelled")
+
+
+def cancel():
+    """Stop a running start()/stop() (job on_cancel hook)."""
+    _cancel.set()
+    log("Cancel requested")
+
+
+def status():
+    v = version()
+    models = loaded_models() if v else []
+    return {
+        "running": v is not None,
+        "version": v,
+        "models": [
+            {"name": m.get("name"), "size_vram": m.get("size_vram"), "expires_at": m.get("expires_at")}
+            for m in models
+        ],
+        "idle_s": None if idle_for() is None else round(idle_for()),
+        "started_here": _started,
+    }
+
+
+# -----------------------------
+# LIFECYCLE
+# -----------------------------
+def preload(model=MODEL):
+    """Load model into VRAM (empty generate) and confirm via /api/ps; returns seconds."""
+    t0 = time.monotonic()
+    # The load can take minutes; run it aside so cancel() doesn't have to wait for it
+    loading = _loader.submit(
+        _pool.request, "POST", "/api/generate", {"model": model, "keep_alive": KEEP_ALIVE})
+    while not wait([loading], timeout=POLL).done:
+        _checkpoint()
+    code, body = loading.result()
+    if code != 200:
+        raise RuntimeError(f"preload of {model} failed ({code}): {body.get('error', body)}")
+    if not any(_is_model(m, model) for m in loaded_models()):
+        raise RuntimeError(f"{model} not listed by /api/ps after preload")
+    return round(time.monotonic() - t0, 3)
+
+
+def unload(everything=False):
+    """keep_alive 0 for MODEL (every loaded model if everything); returns the names unloaded."""
+    names = [m["name"] for m in loaded_models() if everything or _is_model(m)]
+    for name in names:
+        _pool.request("POST", "/api/generate", {"model": name, "keep_alive": 0})
+    if names:
+        log(f"Unloaded {', '.join(names)}")
+    return names
+
+
+def start(load_model=PRELOAD):
+    """Start `ollama serve` in the container if needed; job.result for /ollama_on."""
+    global _started
+    _cancel.clear()
+    with _lock:
+        touch()
+        result = {"already_running": version() is not None}
+        t0 = time.monotonic()
+        if not result["already_running"]:
+            log("Starting ollama server...")
+            proc = container.run([str(ON_SCRIPT)], timeout=STOP_TIMEOUT + START_TIMEOUT,
+                                 cancel=_cancel)
+            _checkpoint()
+            if proc.returncode != 0:
+                raise RuntimeError(f"ollama_on.sh exit {proc.returncode}: {proc.stdout}{proc.stderr}".strip())
+            _started = True
+            if wait_until(lambda: version() is not None, START_TIMEOUT) is None:
+                raise RuntimeError(f"ollama not answering on /api/version after {START_TIMEOUT}s")
+        result["ready_s"] = round(time.monotonic() - t0, 3)
+        result["version"] = version()
+        _checkpoint()
+        if load_model:
+            result["preload_s"] = preload()
+        result["models"] = [m["name"] for m in loaded_models()]
+        log(f"Ollama ready in {result['ready_s']}s"
+            + (f", {MODEL} loaded in {result['preload_s']}s" if load_model else ""))
+        touch()
+        return result
+
+
+def stop():
+    """Unload models and stop the server; job.result for /ollama_off."""
+    global _started
+    _cancel.clear()
+    with _lock:
+        result = {"already_stopped": version() is None}
+        t0 = time.monotonic()
+        if not result["already_stopped"]:
+            result["unloaded"] = unload(everything=True)
+            _checkpoint()
+            log("Stopping ollama server...")
+            container.run([str(OFF_SCRIPT)], timeout=STOP_TIMEOUT + 5, cancel=_cancel)
+            _checkpoint()
+            if wait_until(lambda: version() is None, STOP_TIMEOUT) is None:
+                raise RuntimeError(f"ollama still answering after {STOP_TIMEOUT}s")
+        _started = False
+        result["stopped_s"] = round(time.monotonic() - t0, 3)
+        log(f"Ollama stopped in {result['stopped_s']}s")
+        return result
+
+
+def idle_check():
+    """One pass of watch_idle: unload MODEL once idle, stop the server if start() launched it."""
+    global _resident_at, _started
+    if version() is None:
+        # Stopped by hand; whatever answers next isn't ours
+        _started = False
+        return
+    models = loaded_models()
+    now = time.time()
+    if models:
+        _resident_at = now
+    for m in models:
+        if not _is_model(m):
+            continue
+        used = max((t for t in (_last_used, _used_at(m)) if t is not None), default=None)
+        if IDLE_UNLOAD is not None and used is not None and now - used > IDLE_UNLOAD:
+            log(f"{m['name']} unused for {round(now - used)}s, unloading")
+            unload()
+        return
+    if not _started or models or IDLE_STOP is None:
+        return
+    idle = now - max(_last_used or 0, _resident_at or 0)
+    if idle > IDLE_STOP:
+        log(f"Idle for {round(idle)}s, stopping ollama")
+        stop()
+
+
+async def watch_idle(busy):
+    """Background loop: idle_check() every IDLE_CHECK seconds.
+
+    busy() -> True while an ollama-using job is queued or running.
+    """
+    while True:
+        await asyncio.sleep(IDLE_CHECK)
+        if busy():
+            touch()
+            continue
+        try:
+            await asyncio.to_thread(idle_check)
+        except Exception as e:
+            log(f"Idle check failed: {type(e).__name__}: {e}")
@@ -4,19 +4,26 @@
 
 echo "[ollama_off] Stopping ollama server..."
 
-pkill -f "ollama serve" 2>/dev/null
+# Wait up to STEPS x 0.1s for the server to exit
+wait_gone() {
+    for _ in $(seq "$1"); do
+        pgrep -f "ollama serve" >/dev/null 2>&1 || return 0
+        sleep 0.1
+    done
+    return 1
+}
 
-sleep 1
+pkill -f "ollama serve" 2>/dev/null
 
-# Verify it stopped
-if pgrep -f "ollama serve" >/dev/null 2>&1; then
+if ! wait_gone 100; then
     echo "[ollama_off] WARNING: ollama still running, force killing..."
     pkill -9 -f "ollama serve" 2>/dev/null
-    sleep 1
+    wait_gone 20
 fi
 
 if pgrep -f "ollama serve" >/dev/null 2>&1; then
     echo "[ollama_off] ERROR: Failed to stop ollama server"
+    exit 1
 else
     echo "[ollama_off] Ollama server stopped."
 fi
@@ -1,21 +1,34 @@
 #!/bin/bash
 # Start ollama server inside the distrobox
 # This script runs INSIDE fedora42-nvidia via distrobox enter
+#
+# Readiness is polled on the API instead of sleeping a fixed time. When called
+# from /ollama_on, ollama_manager.py does the polling and preloads the model.
+
+API="http://127.0.0.1:11434/api/version"
+TIMEOUT_STEPS=300   # x 0.1s
 
 echo "[ollama_on] Starting ollama server..."
 
-# Kill any existing ollama serve process
-pkill -f "ollama serve" 2>/dev/null || true
-sleep 1
+# Stop any existing ollama serve process and wait for it to exit
+if pkill -f "ollama serve" 2>/dev/null; then
+    for _ in $(seq 50); do
+        pgrep -f "ollama serve" >/dev/null 2>&1 || break
+        sleep 0.1
+    done
+fi
+
+# Start ollama serve in its own session so it outlives this script
+setsid nohup ollama serve >/tmp/ollama_serve.log 2>&1 < /dev/null &
 
-# Start ollama serve in background
-nohup ollama serve >/tmp/ollama_serve.log 2>&1 &
+for _ in $(seq $TIMEOUT_STEPS); do
+    if curl -sf "$API" >/dev/null 2>&1; then
+        echo "[ollama_on] Ollama server is ready (PID: $(pgrep -f 'ollama serve'))"
+        exit 0
+    fi
+    sleep 0.1
+done
 
-# Wait briefly and verify it started
-sleep 2
-if pgrep -f "ollama serve" >/dev/null 2>&1; then
-    echo "[ollama_on] Ollama server started successfully (PID: $(pgrep -f 'ollama serve'))"
-else
-    echo "[ollama_on] ERROR: Ollama server failed to start. Check /tmp/ollama_serve.log"
-    cat /tmp/ollama_serve.log 2>/dev/null
-fi
+echo "[ollama_on] ERROR: Ollama server did not answer on $API. Check /tmp/ollama_serve.log"
+cat /tmp/ollama_serve.log 2>/dev/null
+exit 1
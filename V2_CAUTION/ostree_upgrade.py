@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
+"""rpm-ostree upgrade in two halves, so the triggered one only takes seconds.
+
+  ostree_upgrade.py --prestage   (scheduled by the service, POST /ostree_prestage)
+      rpm-ostree upgrade --check, and if there is an update --download-only.
+      The outcome is cached in PRESTAGE_FILE.
+  ostree_upgrade.py              (/ostree_upgrade, setup_thinkpad)
+      Answers "already up to date" or "already staged" from the cache
+      without touching the network or D-Bus (unless --fresh). Otherwise it
+      runs the upgrade, with --cache-only when the prestage already
+      downloaded everything.
+
+Whether a deployment is staged comes from `rpm-ostree status --json`, not
+from rpm-ostree's wording.
+"""
+import json
+import os
 import subprocess
+import sys
+import time
 from datetime import datetime
 from pathlib import Path
 
+import logstore
+
 BASE_DIR = Path("/var/home/fraser/backup_service")
 LOG_FILE = BASE_DIR / "ostree_upgrade.log"
+PRESTAGE_FILE = BASE_DIR / "ostree_prestage.json"
+# A cached "up to date" older than this is checked again
+PRESTAGE_MAX_AGE = 12 * 3600
+# rpm-ostree --unchanged-exit-77: nothing new to check for / deploy
+UNCHANGED = 77
 
 def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with LOG_FILE.open("a") as f:
-        f.write(f"{timestamp} {msg}\n")
+    logstore.append_line(LOG_FILE, f"{timestamp} {msg}")
     print(msg)
 
 def run(cmd):
@@ -19,24 +43,153 @@ def run(cmd):
         log("✓ Success")
         if result.stdout.strip():
             log(f"stdout: {result.stdout.strip()}")
+    elif result.returncode == UNCHANGED:
+        log("✓ Nothing new")
     else:
         log(f"✗ Failed with exit code {result.returncode}")
         if result.stderr.strip():
             log(f"stderr: {result.stderr.strip()}")
     return result
 
-def main():
-    log("=== OSTREE UPGRADE STARTED ===")
+# -----------------------------
+# STATE
+# -----------------------------
+def booted_ref():
+    """The booted deployment's ostree= kernel argument (changes with each new deployment)."""
+    try:
+        args = Path("/proc/cmdline").read_text().split()
+    except OSError:
+        return None
+    return next((a for a in args if a.startswith("ostree=")), None)
 
-    result = run(["rpm-ostree", "upgrade"])
+def load_cache():
+    try:
+        return json.loads(PRESTAGE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    tmp = PRESTAGE_FILE.with_name(f".{PRESTAGE_FILE.name}.tmp")
+    tmp.write_text(json.dumps(cache, indent=2))
+    os.replace(tmp, PRESTAGE_FILE)
+
+def cached_state(cache=None):
+    """The cached outcome ("up_to_date" / "staged") if it still holds for this boot, else None."""
+    cache = load_cache() if cache is None else cache
+    if not cache or cache.get("boot") != booted_ref():
+        # Rebooted into another deployment since (or never checked)
+        return None
+    if cache.get("staged"):
+        return "staged"
+    if cache.get("update_available") is False and time.time() - cache.get("checked_ts", 0) < PRESTAGE_MAX_AGE:
+        return "up_to_date"
+    return None
+
+def staged_deployment():
+    """The staged deployment from `rpm-ostree status --json`, or None."""
+    result = subprocess.run(["rpm-ostree", "status", "--json"], capture_output=True, text=True,
+                            timeout=60)
     if result.returncode != 0:
+        raise RuntimeError(f"rpm-ostree status failed: {result.stderr.strip()}")
+    for d in json.loads(result.stdout).get("deployments", []):
+        if d.get("staged"):
+            return {"checksum": d.get("checksum"), "version": d.get("version"),
+                    "timestamp": d.get("timestamp")}
+    return None
+
+def _available_version(stdout):
+    for line in stdout.splitlines():
+        if line.strip().startswith("Version:"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+# -----------------------------
+# PRESTAGE (background)
+# -----------------------------
+def prestage():
+    log("=== OSTREE PRESTAGE STARTED ===")
+    t0 = time.monotonic()
+    cache = {"boot": booted_ref(), "checked": datetime.now().isoformat(timespec="seconds"),
+             "checked_ts": time.time(), "staged": None, "downloaded": False}
+
+    result = run(["rpm-ostree", "upgrade", "--check", "--unchanged-exit-77"])
+    if result.returncode not in (0, UNCHANGED):
+        log("ERROR: rpm-ostree upgrade --check failed")
+        return False
+    cache["update_available"] = result.returncode == 0
+    cache["version"] = _available_version(result.stdout) if cache["update_available"] else None
+
+    if cache["update_available"]:
+        result = run(["rpm-ostree", "upgrade", "--download-only"])
+        if result.returncode != 0:
+            log("ERROR: rpm-ostree upgrade --download-only failed")
+            save_cache(cache)
+            return False
+        cache["downloaded"] = True
+    cache["staged"] = staged_deployment()
+    cache["seconds"] = round(time.monotonic() - t0, 1)
+    save_cache(cache)
+
+    if cache["staged"]:
+        log(f"Deployment {cache['staged']['version']} already staged, reboot to apply")
+    elif cache["update_available"]:
+        log(f"Update {cache['version'] or ''} downloaded, /ostree_upgrade will stage it from cache")
+    else:
+        log("System up to date")
+    log(f"=== OSTREE PRESTAGE COMPLETED in {cache['seconds']}s ===")
+    return True
+
+# -----------------------------
+# FINALIZE (triggered)
+# -----------------------------
+def finalize(use_cache=True):
+    """Stage the upgrade; returns {"ok", "outcome": up_to_date|staged|failed, "source", "seconds"}."""
+    t0 = time.monotonic()
+    cache = load_cache()
+    state = cached_state(cache) if use_cache else None
+    if state == "up_to_date":
+        log(f"System already up to date (checked {cache['checked']}, from cache)")
+        return {"ok": True, "outcome": "up_to_date", "source": "cache", "seconds": 0}
+    if state == "staged":
+        log(f"Deployment {cache['staged']['version']} already staged (from cache), reboot to apply")
+        return {"ok": True, "outcome": "staged", "source": "cache", "seconds": 0}
+
+    cmd = ["rpm-ostree", "upgrade", "--unchanged-exit-77"]
+    source = "network"
+    if cache.get("downloaded") and cache.get("boot") == booted_ref():
+        cmd.append("--cache-only")
+        source = "prestage"
+    result = run(cmd)
+    if result.returncode not in (0, UNCHANGED) and source == "prestage":
+        # Downloaded data gone (e.g. pruned); fetch it after all
+        log("Cached upgrade failed, retrying with download")
+        source = "network"
+        result = run(cmd[:-1])
+    if result.returncode not in (0, UNCHANGED):
         log("ERROR: rpm-ostree upgrade failed")
-        return
+        return {"ok": False, "outcome": "failed", "source": source,
+                "seconds": round(time.monotonic() - t0, 1)}
 
-    if not result.stdout.strip():
-        log("System already up to date (no new deployment staged)")
+    staged = staged_deployment()
+    save_cache({
+        **cache, "boot": booted_ref(), "update_available": False, "downloaded": False,
+        "staged": staged, "checked": datetime.now().isoformat(timespec="seconds"),
+        "checked_ts": time.time(),
+    })
+    seconds = round(time.monotonic() - t0, 1)
+    if staged:
+        log(f"Deployment {staged['version']} staged in {seconds}s ({source}), reboot to apply")
+        return {"ok": True, "outcome": "staged", "source": source, "seconds": seconds}
+    log("System already up to date (no new deployment staged)")
+    return {"ok": True, "outcome": "up_to_date", "source": source, "seconds": seconds}
 
+def main():
+    if "--prestage" in sys.argv[1:]:
+        return prestage()
+    log("=== OSTREE UPGRADE STARTED ===")
+    ok = finalize(use_cache="--fresh" not in sys.argv[1:])["ok"]
     log("=== OSTREE UPGRADE COMPLETED ===")
+    return ok
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,116 @@
+"""In-memory cache for the HTML pages in templates/.
+
+Each page is read once, hashed for a strong ETag and pre-compressed (gzip, and
+brotli when the optional `brotli` package is installed). The file's mtime is
+re-checked at most every STAT_INTERVAL seconds, so editing a template still
+shows up without a restart; the stat and any reload run in a worker thread so
+they never block the event loop. Repeat visits from the phone get a 304.
+"""
+import asyncio
+import gzip
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+from fastapi import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEMPLATE_DIR = Path("/var/home/fraser/backup_service/templates")
+STAT_INTERVAL = 2.0
+
+_pages = {}
+_lock = threading.Lock()
+
+
+class _Page:
+    __slots__ = ("mtime", "checked", "etag", "variants")
+
+    def __init__(self, path):
+        st = path.stat()
+        body = path.read_bytes()
+        self.mtime = st.st_mtime_ns
+        self.checked = time.monotonic()
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        # encoding -> (bytes, etag); each variant needs its own strong ETag
+        self.variants = {"identity": (body, f'"{self.etag}"')}
+        self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{self.etag}-gz"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body), f'"{self.etag}-br"')
+
+
+def _cached(name):
+    """The cached page if it was checked recently enough to skip the stat."""
+    with _lock:
+        page = _pages.get(name)
+    if page is not None and time.monotonic() - page.checked < STAT_INTERVAL:
+        return page
+    return None
+
+
+def _refresh(name):
+    path = TEMPLATE_DIR / name
+    with _lock:
+        page = _pages.get(name)
+    if page is not None and os.stat(path).st_mtime_ns == page.mtime:
+        page.checked = time.monotonic()
+        return page
+    page = _Page(path)
+    with _lock:
+        _pages[name] = page
+    return page
+
+
+def _qvalue(params):
+    for param in params:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def _encoding(accept):
+    """Encodings the client accepts, best first; identity is always the fallback."""
+    weights = {}
+    for part in accept.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if coding:
+            weights[coding] = _qvalue(params)
+    wildcard = weights.get("*", 0.0)
+    offered = [(weights.get(enc, wildcard), enc) for enc in ("br", "gzip")]
+    # sorted() is stable, so br wins a tie with gzip
+    for q, enc in sorted(offered, key=lambda o: -o[0]):
+        if q > 0:
+            yield enc
+    yield "identity"
+
+
+async def page(request, name):
+    """Response for templates/name honouring Accept-Encoding and If-None-Match."""
+    cached = _cached(name) or await asyncio.to_thread(_refresh, name)
+    for enc in _encoding(request.headers.get("accept-encoding", "")):
+        if enc in cached.variants:
+            break
+    body, etag = cached.variants[enc]
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        # Always revalidate, which costs a 304 once the page is cached
+        "Cache-Control": "no-cache",
+    }
+    if enc != "identity":
+        headers["Content-Encoding"] = enc
+
+    inm = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in inm.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
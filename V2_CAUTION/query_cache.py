@@ -0,0 +1,82 @@
+"""Result cache for the DB2 / Missouri mainframe queries.
+
+Each zowe job round trip takes many seconds, so results are kept per query key:
+  - younger than TTL: served straight from memory
+  - older than TTL but within STALE: served immediately, one background refresh
+  - older than that (or missing): the caller waits for a single shared refresh
+Writes call invalidate() so the next read goes back to the mainframe.
+"""
+import asyncio
+import inspect
+import time
+
+TTL = 300
+STALE = 3600
+
+_entries = {}      # key -> (value, fetched_at)
+_refreshing = {}   # key -> asyncio.Task
+_generation = {}   # key -> bumped by invalidate() so in-flight refreshes don't resurrect old data
+_tasks = set()
+
+
+async def get(key, loader, ttl=TTL, stale=STALE, fresh=False):
+    """Return the cached value for key, loading it with loader().
+
+    loader is either a blocking function (run in a thread) or an async one.
+    loader() returning None means "failed" and is never cached.
+    """
+    entry = _entries.get(key)
+    if entry and not fresh:
+        age = time.monotonic() - entry[1]
+        if age < ttl:
+            return entry[0]
+        if age < ttl + stale:
+            _refresh(key, loader)
+            return entry[0]
+    # shield: a client disconnecting must not cancel the shared refresh
+    return await asyncio.shield(_refresh(key, loader))
+
+
+def _refresh(key, loader):
+    task = _refreshing.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_load(key, loader))
+        _refreshing[key] = task
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        # Background refreshes may fail with nobody awaiting them
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def _load(key, loader):
+    gen = _generation.get(key, 0)
+    try:
+        if inspect.iscoroutinefunction(loader):
+            value = await loader()
+        else:
+            value = await asyncio.to_thread(loader)
+    finally:
+        if _refreshing.get(key) is asyncio.current_task():
+            _refreshing.pop(key)
+    if value is not None and _generation.get(key, 0) == gen:
+        _entries[key] = (value, time.monotonic())
+    return value
+
+
+def invalidate(match):
+    """Drop every key for which match(key) is true."""
+    for key in set(_entries) | set(_refreshing):
+        if match(key):
+            _entries.pop(key, None)
+            # A refresh already in flight may predate the write; the next read starts a new one
+            _refreshing.pop(key, None)
+            _generation[key] = _generation.get(key, 0) + 1
+
+
+def stats():
+    now = time.monotonic()
+    return {
+        key: {"age": round(now - fetched, 1), "refreshing": key in _refreshing}
+        for key, (_, fetched) in _entries.items()
+    }
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Restic repo maintenance: forget --prune with a retention policy, then a rotating
+# `check --read-data-subset=n/N` so every pack is verified once every N runs.
+# This script runs INSIDE fedora42-nvidia (like backup.py), triggered by
+# POST /restic_maintenance. The report is kept in restic_maintenance.json.
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+STATE_FILE = BASE_DIR / "restic_maintenance.json"
+PASSWORD_FILE = "/var/home/fraser/.restic_password"
+
+REPOS = [
+    "/run/media/fraser/ows/restic-repo",
+    "/run/media/fraser/ows/restic_backup_ml",
+]
+
+RETENTION = [
+    "--keep-daily", "7",
+    "--keep-weekly", "5",
+    "--keep-monthly", "12",
+    "--keep-yearly", "3",
+]
+
+# The whole repo is read back once every CHECK_SUBSETS runs
+CHECK_SUBSETS = 12
+
+
+def log(msg):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{timestamp} {msg}", flush=True)
+
+
+def restic(repo, *args):
+    cmd = ["restic", "-r", repo, "--password-file", PASSWORD_FILE, *args]
+    log(f"Running: {' '.join(cmd)}")
+    t0 = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = round(time.monotonic() - t0, 1)
+    if result.returncode != 0:
+        log(f"✗ Failed with exit code {result.returncode} after {elapsed}s")
+        if result.stderr.strip():
+            log(f"stderr: {result.stderr.strip()}")
+    else:
+        log(f"✓ Success in {elapsed}s")
+    return result, elapsed
+
+
+def repo_size(repo):
+    result, _ = restic(repo, "stats", "--mode", "raw-data", "--json")
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)["total_size"]
+    except (ValueError, KeyError):
+        return None
+
+
+def load_state():
+    if STATE_FILE.exists():
+        with STATE_FILE.open() as f:
+            return json.load(f)
+    return {"next_subset": {}, "last_run": None}
+
+
+def save_state(state):
+    tmp = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump(state, f, indent=2)
+    tmp.replace(STATE_FILE)
+
+
+def maintain(repo, subset):
+    report = {"repo": repo, "subset": f"{subset}/{CHECK_SUBSETS}", "ok": False}
+    t0 = time.monotonic()
+
+    before = repo_size(repo)
+    result, report["forget_prune_s"] = restic(repo, "forget", "--prune", *RETENTION)
+    if result.returncode != 0:
+        report["error"] = "forget --prune failed"
+        return report
+    after = repo_size(repo)
+    if before is not None and after is not None:
+        report["size_before"] = before
+        report["size_after"] = after
+        report["reclaimed"] = before - after
+
+    result, report["check_s"] = restic(
+        repo, "check", f"--read-data-subset={subset}/{CHECK_SUBSETS}")
+    if result.returncode != 0:
+        report["error"] = "check failed"
+        return report
+
+    report["ok"] = True
+    report["duration_s"] = round(time.monotonic() - t0, 1)
+    return report
+
+
+def main():
+    log("=== RESTIC MAINTENANCE STARTED ===")
+    missing = [r for r in REPOS if not Path(r).is_dir()]
+    if missing:
+        log(f"Backup drive not mounted ({', '.join(missing)}). Aborting.")
+        return False
+
+    state = load_state()
+    started = time.monotonic()
+    reports = []
+    for repo in REPOS:
+        subset = state["next_subset"].get(repo, 1)
+        report = maintain(repo, subset)
+        reports.append(report)
+        if report["ok"]:
+            state["next_subset"][repo] = subset % CHECK_SUBSETS + 1
+        line = f"{repo}: {'ok' if report['ok'] else report.get('error')}"
+        if report.get("reclaimed") is not None:
+            line += f", reclaimed {report['reclaimed'] / 1e6:.1f} MB"
+        log(line)
+
+    state["last_run"] = {
+        "finished": datetime.now().isoformat(),
+        "duration_s": round(time.monotonic() - started, 1),
+        "reclaimed": sum(r.get("reclaimed") or 0 for r in reports),
+        "ok": all(r["ok"] for r in reports),
+        "repos": reports,
+    }
+    save_state(state)
+    log(f"=== RESTIC MAINTENANCE COMPLETED in {state['last_run']['duration_s']}s ===")
+    return state["last_run"]["ok"]
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
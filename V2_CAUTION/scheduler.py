@@ -0,0 +1,184 @@
+"""Resource-class scheduler for jobs and mainframe queries.
+
+While it runs, a task holds the resource classes it declares (jobs.RESOURCES).
+Each class admits LIMITS[name] holders at once. Two GPU jobs therefore queue
+one behind the other, while a backup and an OCR run side by side. Waiters are
+served highest priority first and in arrival order within a priority. A
+waiter that cannot start keeps its classes reserved, so a later job on the
+same class can't jump ahead of it; jobs on other classes still start.
+MAX_RUNNING caps all holders together, including those with no classes.
+
+Run times are learned per task (an EWMA of successful runs, seeded from the
+log index after a restart). forecast() plays the queue forward with them to
+give each waiter a queue position and an estimated start.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+LIMITS = {
+    "gpu": 1,             # glm-ocr, Cohere/torch and nvidia-smi share one card's VRAM
+    "backup-disk": 1,     # restic repo and ostree staging saturate the same disk
+    "mainframe": 2,       # zowe job submits in flight at once
+    "system-update": 1,   # rpm-ostree, kernel args, reboot
+}
+# Holders of any kind at once (the old jobs.MAX_RUNNING)
+MAX_RUNNING = 8
+# Weight of the newest run in a task's expected run time
+EWMA = 0.3
+
+_seq = itertools.count(1)
+_waiting = []
+_running = []
+_expected = {}   # task -> seconds
+
+
+class Claim:
+    def __init__(self, owner, task, classes, priority):
+        unknown = set(classes) - set(LIMITS)
+        if unknown:
+            raise ValueError(f"unknown resource class {', '.join(sorted(unknown))}")
+        self.owner = owner
+        self.task = task
+        self.classes = tuple(classes)
+        self.priority = priority
+        self.seq = next(_seq)
+        self.queued = time.time()
+        self.granted = None
+        self._granted = asyncio.get_running_loop().create_future()
+
+    def conflicts(self, other):
+        # Classless claims only compete for MAX_RUNNING, i.e. with everything
+        return not self.classes or not other.classes or bool(set(self.classes) & set(other.classes))
+
+
+async def acquire(owner, task, classes=(), priority=0):
+    """Wait until classes are free for owner; returns the Claim to release()."""
+    claim = Claim(owner, task, classes, priority)
+    _waiting.append(claim)
+    _dispatch()
+    try:
+        await claim._granted
+    except asyncio.CancelledError:
+        if claim in _waiting:
+            _waiting.remove(claim)
+        release(claim)
+        raise
+    return claim
+
+
+def release(claim):
+    if claim in _running:
+        _running.remove(claim)
+    _dispatch()
+
+
+@asynccontextmanager
+async def hold(classes, owner, task=None, priority=0):
+    claim = await acquire(owner, task or owner, classes, priority)
+    try:
+        yield claim
+    finally:
+        release(claim)
+
+
+def _in_use(name):
+    return sum(name in c.classes for c in _running)
+
+
+def _order():
+    return sorted(_waiting, key=lambda c: (-c.priority, c.seq))
+
+
+def _dispatch():
+    reserved = set()
+    for claim in _order():
+        if len(_running) >= MAX_RUNNING:
+            return
+        if claim._granted.done():
+            # cancelled; acquire() is about to drop it
+            continue
+        free = all(_in_use(c) < LIMITS[c] for c in claim.classes)
+        if free and not reserved & set(claim.classes):
+            _waiting.remove(claim)
+            claim.granted = time.time()
+            _running.append(claim)
+            claim._granted.set_result(None)
+        else:
+            reserved.update(claim.classes)
+
+
+# -----------------------------
+# ESTIMATES
+# -----------------------------
+def record(task, seconds):
+    prev = _expected.get(task)
+    _expected[task] = seconds if prev is None else prev + EWMA * (seconds - prev)
+
+
+def expected(task):
+    return _expected.get(task)
+
+
+def forecast():
+    """owner -> {queue_position, estimated_start, waiting_on} for every waiting claim.
+
+    queue_position counts the waiters ahead that compete for the same classes
+    (1 = next). estimated_start is None while a run time it depends on is unknown.
+    """
+    now = time.time()
+    inf = float("inf")
+    # Per class, one entry per slot: when that slot frees up
+    slots = {name: [now] * limit for name, limit in LIMITS.items()}
+    slots["*"] = [now] * MAX_RUNNING
+    for name in slots:
+        holders = [c for c in _running if name == "*" or name in c.classes]
+        for i, claim in enumerate(holders[:len(slots[name])]):
+            slots[name][i] = _end(claim.task, claim.granted, now)
+        heapq.heapify(slots[name])
+
+    out = {}
+    ahead = []
+    for claim in _order():
+        names = (*claim.classes, "*")
+        start = max(slots[name][0] for name in names)
+        run = expected(claim.task)
+        end = start + run if run is not None else inf
+        for name in names:
+            heapq.heapreplace(slots[name], end)
+        blockers = [c.owner for c in _running if c.conflicts(claim)]
+        out[claim.owner] = {
+            "queue_position": 1 + sum(c.conflicts(claim) for c in ahead),
+            "estimated_start": None if start == inf else start,
+            "waiting_on": blockers if claim.classes else [],
+        }
+        ahead.append(claim)
+    return out
+
+
+def _end(task, granted, now):
+    run = expected(task)
+    if run is None:
+        return float("inf")
+    # Overdue runs are assumed to finish any moment now
+    return max(granted + run, now)
+
+
+def snapshot():
+    """Classes with their limit, holders and waiters (GET /scheduler)."""
+    waiting = _order()
+    return {
+        "max_running": MAX_RUNNING,
+        "running": len(_running),
+        "classes": {
+            name: {
+                "limit": limit,
+                "holders": [c.owner for c in _running if name in c.classes],
+                "waiting": [c.owner for c in waiting if name in c.classes],
+            }
+            for name, limit in LIMITS.items()
+        },
+        "expected_seconds": {task: round(s, 1) for task, s in _expected.items()},
+    }
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Pre-forked interpreter for the host scripts (kleopatra, nvidia_fix, ostree_upgrade).
+
+`uv run script.py` resolves the environment and starts a fresh interpreter
+before the script makes its first subprocess call, and that start-up costs
+more than the script's own work. Instead, one long-lived server process
+(`script_pool.py serve`, started on demand by the service) imports the task
+modules once. For each run it forks, and the child calls `module.main()`.
+Every run still has its own process, so a crash or a hung `gpg` only takes
+down that child. The scripts keep writing their own .log files.
+
+The wire protocol is the container agent's (see container_agent.py), so the job
+engine drives a pooled run exactly like a container one:
+    client -> pool    {"task": "kleopatra", "argv": [...]}   or   {"ping": true}
+    pool   -> client  {"pid": n}, {"stream": ..., "data": ...}*, {"exit": code}
+    client -> pool    {"signal": n}           forwarded to the run's process group
+A client that disconnects mid-run gets the run SIGTERMed, then SIGKILLed after KILL_GRACE.
+
+The child sees sys.argv as [script, *argv], like `python3 script.py ...` would.
+main() returning None/True exits 0, False exits 1, an int is the exit code.
+"""
+import asyncio
+import importlib
+import json
+import os
+import selectors
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import container
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+SOCKET_PATH = BASE_DIR / "script_pool.sock"
+POOL_SCRIPT = BASE_DIR / "script_pool.py"
+POOL_LOG = BASE_DIR / "script_pool.log"
+POOL_START_TIMEOUT = 10
+READ_CHUNK = 65536
+# SIGTERM -> SIGKILL when a client disconnects from a run that won't exit
+KILL_GRACE = 10
+
+# Importable host scripts; each module has main()
+TASKS = ("kleopatra", "nvidia_fix", "ostree_upgrade")
+
+# task -> time.time() it was imported by the pool server
+_imported_at = {}
+
+
+# -----------------------------
+# POOL SERVER (serve)
+# -----------------------------
+def _exit_code(rv):
+    if rv is None or rv is True:
+        return 0
+    if rv is False:
+        return 1
+    return int(rv)
+
+
+def _load(name):
+    """The pre-imported module, re-imported in this child if the file was edited since."""
+    module = importlib.import_module(name)
+    source = Path(module.__file__)
+    if source.stat().st_mtime > _imported_at.get(name, 0):
+        module = importlib.reload(module)
+    return module
+
+
+def _child(name, argv, out_w, err_w):
+    """Runs in the forked child: stdout/stderr onto the pipes, then main()."""
+    code = 1
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        sys.stdout.reconfigure(line_buffering=True)
+        sys.stderr.reconfigure(line_buffering=True)
+        module = _load(name)
+        sys.argv = [module.__file__, *argv]
+        code = _exit_code(module.main())
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """Runs in a forked copy of the pool server, one per connection."""
+
+    def send(self, obj):
+        self.request.sendall(json.dumps(obj).encode() + b"\n")
+
+    def handle(self):
+        buf = b""
+        while b"\n" not in buf:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            buf += chunk
+        line, buf = buf.split(b"\n", 1)
+        try:
+            req = json.loads(line)
+        except ValueError:
+            return
+
+        if req.get("ping"):
+            # this handler is a fork; report the pool server itself
+            self.send({"pong": os.getppid(), "tasks": list(TASKS)})
+            return
+        name = req.get("task")
+        if name not in TASKS:
+            self.send({"pid": None})
+            self.send({"stream": "stderr", "data": f"script_pool: unknown task {name!r}\n"})
+            self.send({"exit": 127})
+            return
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            self.request.close()
+            os.close(out_r)
+            os.close(err_r)
+            _child(name, [str(a) for a in req.get("argv") or ()], out_w, err_w)
+        os.close(out_w)
+        os.close(err_w)
+        self.send({"pid": pid})
+        self.pump(pid, {out_r: "stdout", err_r: "stderr"}, buf)
+
+    def pump(self, pid, pipes, buf):
+        sel = selectors.DefaultSelector()
+        for fd in pipes:
+            sel.register(fd, selectors.EVENT_READ)
+        sel.register(self.request, selectors.EVENT_READ)
+        client_gone = False
+        kill_at = None
+        try:
+            while pipes:
+                if kill_at is not None and time.monotonic() >= kill_at:
+                    _killpg(pid, signal.SIGKILL)
+                    kill_at = None
+                timeout = None if kill_at is None else max(kill_at - time.monotonic(), 0)
+                for key, _ in sel.select(timeout):
+                    if key.fileobj is self.request:
+                        chunk = self.request.recv(4096)
+                        if not chunk:
+                            # client gave up on this run
+                            client_gone = True
+                            sel.unregister(self.request)
+                            _killpg(pid, signal.SIGTERM)
+                            kill_at = time.monotonic() + KILL_GRACE
+                            continue
+                        buf += chunk
+                        while b"\n" in buf:
+                            line, buf = buf.split(b"\n", 1)
+                            msg = json.loads(line or b"{}")
+                            if "signal" in msg:
+                                _killpg(pid, int(msg["signal"]))
+                        continue
+                    data = os.read(key.fd, READ_CHUNK)
+                    if not data:
+                        sel.unregister(key.fd)
+                        os.close(key.fd)
+                        del pipes[key.fd]
+                        continue
+                    if not client_gone:
+                        self.send({"stream": pipes[key.fd],
+                                   "data": data.decode("utf-8", "surrogateescape")})
+        except (BrokenPipeError, ConnectionError):
+            _killpg(pid, signal.SIGTERM)
+            client_gone = True
+            kill_at = time.monotonic() + KILL_GRACE
+        if client_gone:
+            _reap(pid, kill_at)
+            return
+        _, status = os.waitpid(pid, 0)
+        self.send({"exit": os.waitstatus_to_exitcode(status)})
+
+
+def _killpg(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _reap(pid, kill_at):
+    """Wait for a SIGTERMed child, SIGKILLing its group at kill_at (None: already done)."""
+    while not os.waitpid(pid, os.WNOHANG)[0]:
+        if kill_at is not None and time.monotonic() >= kill_at:
+            _killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            return
+        time.sleep(0.05)
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def serve():
+    if ping():
+        print("[script_pool] another pool is already listening, exiting")
+        return
+    for name in TASKS:
+        t0 = time.time()
+        try:
+            importlib.import_module(name)
+            _imported_at[name] = t0
+        except Exception as e:
+            # reported again, per run, by the child that tries to use it
+            print(f"[script_pool] cannot import {name}: {e}", flush=True)
+    SOCKET_PATH.unlink(missing_ok=True)
+    server = Server(str(SOCKET_PATH), Handler)
+    os.chmod(SOCKET_PATH, 0o600)
+    print(f"[script_pool] listening on {SOCKET_PATH} (pid {os.getpid()}, "
+          f"tasks {', '.join(n for n in TASKS if n in _imported_at)})", flush=True)
+    server.serve_forever()
+
+
+# -----------------------------
+# CLIENT (service side)
+# -----------------------------
+def ping(timeout=1.0):
+    """Return the pool's pong dict, or None if nothing answers on the socket."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(b'{"ping": true}\n')
+        return json.loads(s.makefile("rb").readline() or b"null")
+    except (OSError, ValueError):
+        return None
+    finally:
+        s.close()
+
+
+def ensure_pool():
+    """Start the pool server unless one already answers."""
+    if ping():
+        return True
+    try:
+        with POOL_LOG.open("a") as log:
+            subprocess.Popen(
+                [sys.executable, str(POOL_SCRIPT), "serve"],
+                cwd=BASE_DIR,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+    except OSError as e:
+        # Callers run the script cold instead
+        print(f"[script_pool] cannot start the pool: {e}", flush=True)
+        return False
+    deadline = time.monotonic() + POOL_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if ping():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def cold_cmd(task, *args):
+    return [sys.executable, str(BASE_DIR / f"{task}.py"), *args]
+
+
+async def _connect():
+    return await asyncio.open_unix_connection(str(SOCKET_PATH), limit=container.FRAME_LIMIT)
+
+
+async def spawn(task, *args):
+    """Start a pooled run of task (args become its sys.argv[1:]).
+
+    Returns a container.AgentProcess, or a cold Process if the pool can't start.
+    """
+    try:
+        reader, writer = await _connect()
+    except OSError:
+        try:
+            if not await asyncio.to_thread(ensure_pool):
+                raise OSError("script pool not running")
+            reader, writer = await _connect()
+        except OSError:
+            return await asyncio.create_subprocess_exec(
+                *cold_cmd(task, *args),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+    writer.write(json.dumps({"task": task, "argv": list(args)}).encode() + b"\n")
+    await writer.drain()
+    p = container.AgentProcess([task, *args], reader, writer)
+    await p._start()
+    return p
+
+
+def run(task, *args, timeout=None, cancel=None):
+    """subprocess.run(..., capture_output=True, text=True) equivalent for setup_thinkpad.
+
+    timeout and cancel behave as in container.run().
+    """
+    if not ensure_pool():
+        return container.run_cold(cold_cmd(task, *args), [task, *args], timeout, cancel)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(json.dumps({"task": task, "argv": list(args)}).encode() + b"\n")
+        return container.collect(s, [task, *args], timeout, cancel)
+    except socket.timeout:
+        raise subprocess.TimeoutExpired(task, timeout)
+    finally:
+        s.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        serve()
+    else:
+        print(f"usage: {sys.argv[0]} serve", file=sys.stderr)
+        sys.exit(2)
@@ -1,26 +1,65 @@
+import copy
+import os
+import signal
 import subprocess
 import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 
+import container
+import health
+import logstore
+import ostree_upgrade
+import script_pool
+
 BASE_DIR = Path("/var/home/fraser/backup_service")
 STATUS_FILE = BASE_DIR / "setup_thinkpad_status.json"
 LOG_FILE = BASE_DIR / "setup_thinkpad.log"
-CONTAINER_NAME = "fedora42-nvidia"
+# Status changes within this window are written to disk once
+SAVE_DEBOUNCE = 0.5
+# Seconds before a phase's command is killed and the phase fails (run_cmd timeout=)
+CMD_TIMEOUT = 600
+
+# In-memory status is the source of truth; STATUS_FILE is only for restarts.
+_status = None
+_lock = threading.RLock()
+_write_lock = threading.Lock()
+_write_timer = None
+_subscribers = set()
+# Set by cancel(); run_cmd() stops starting (and kills) commands while it is set
+_cancel = threading.Event()
+_children = set()
+
+
+class Cancelled(Exception):
+    pass
 
 
 def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"{timestamp} {msg}"
-    with LOG_FILE.open("a") as f:
-        f.write(line + "\n")
+    logstore.append_line(LOG_FILE, line)
     print(line)
 
 
 def load_status():
+    """Snapshot of the current status (read from disk only on first use)."""
+    global _status
+    with _lock:
+        if _status is None:
+            _status = _read_status_file()
+        return copy.deepcopy(_status)
+
+
+def _read_status_file():
     if STATUS_FILE.exists():
-        with STATUS_FILE.open() as f:
-            return json.load(f)
+        try:
+            with STATUS_FILE.open() as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            log(f"WARNING: {STATUS_FILE.name} unreadable, starting fresh")
     return new_status()
 
 
@@ -40,28 +79,143 @@ def new_status():
 
 
 def save_status(status):
-    status["updated"] = datetime.now().isoformat()
-    with STATUS_FILE.open("w") as f:
-        json.dump(status, f, indent=2)
-
-
-def run_cmd(cmd, **kwargs):
-    log(f"Running: {' '.join(cmd)}")
-    result = subprocess.run(cmd, capture_output=True, text=True, **kwargs)
+    """Make status current, push it to subscribers and schedule a disk write."""
+    global _status, _write_timer
+    with _lock:
+        status["updated"] = datetime.now().isoformat()
+        _status = status
+        snapshot = copy.deepcopy(status)
+        if _write_timer is None:
+            _write_timer = threading.Timer(SAVE_DEBOUNCE, flush_status)
+            _write_timer.start()
+    _publish(snapshot)
+
+
+def flush_status():
+    """Write the current status atomically (temp file + rename)."""
+    global _write_timer
+    # The debounce timer and run_setup()'s final flush can overlap; they share the
+    # temp file, so one writes and renames at a time (snapshot taken inside, so the
+    # later writer also has the newer status)
+    with _write_lock:
+        with _lock:
+            _write_timer = None
+            if _status is None:
+                return
+            data = json.dumps(_status, indent=2)
+        tmp = STATUS_FILE.with_name(STATUS_FILE.name + ".tmp")
+        with tmp.open("w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, STATUS_FILE)
+
+
+def subscribe(loop, queue):
+    """Deliver every status change to an asyncio.Queue(maxsize=1) on loop (latest wins)."""
+    with _lock:
+        _subscribers.add((loop, queue))
+
+
+def unsubscribe(loop, queue):
+    with _lock:
+        _subscribers.discard((loop, queue))
+
+
+def _publish(snapshot):
+    with _lock:
+        subscribers = list(_subscribers)
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(_put_latest, queue, snapshot)
+        except RuntimeError:
+            # loop already closed
+            unsubscribe(loop, queue)
+
+
+def _put_latest(queue, snapshot):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(snapshot)
+
+
+def cancel():
+    """Stop a running setup (job on_cancel hook): kill its commands, start no new ones."""
+    _cancel.set()
+    log("Cancel requested")
+    for p in list(_children):
+        _killpg(p.pid, signal.SIGTERM)
+
+
+def _killpg(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _run_host(cmd, timeout):
+    # Own session so a timeout or cancel() takes down everything cmd started
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                         start_new_session=True)
+    _children.add(p)
+    try:
+        stdout, stderr = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _killpg(p.pid, signal.SIGKILL)
+        stdout, stderr = p.communicate()
+        raise subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+    finally:
+        _children.discard(p)
+    return subprocess.CompletedProcess(cmd, p.returncode, stdout, stderr)
+
+
+def run_cmd(cmd, in_container=False, in_pool=False, timeout=CMD_TIMEOUT):
+    if _cancel.is_set():
+        raise Cancelled("setup cancelled")
+    where = " (in container)" if in_container else " (script pool)" if in_pool else ""
+    log(f"Running: {' '.join(cmd)}{where}")
+    try:
+        if in_container:
+            result = container.run(cmd, timeout=timeout, cancel=_cancel)
+        elif in_pool:
+            result = script_pool.run(*cmd, timeout=timeout, cancel=_cancel)
+        else:
+            result = _run_host(cmd, timeout)
+    except subprocess.TimeoutExpired as e:
+        # Keep what it printed before it was killed
+        log(f"Timed out after {timeout}s: {' '.join(cmd)}")
+        result = subprocess.CompletedProcess(
+            cmd, -signal.SIGKILL, _output(e.stdout), f"{_output(e.stderr)}\ntimed out after {timeout}s")
     if result.stdout.strip():
         log(f"stdout: {result.stdout.strip()}")
     if result.stderr.strip():
         log(f"stderr: {result.stderr.strip()}")
+    if _cancel.is_set():
+        raise Cancelled("setup cancelled")
     return result
 
 
+def _output(data):
+    if isinstance(data, bytes):
+        return data.decode(errors="replace")
+    return data or ""
+
+
 def nvidia_smi_ok():
     """Check if nvidia-smi works (run inside the container)."""
-    result = subprocess.run(
-        ["distrobox", "enter", CONTAINER_NAME, "--", "nvidia-smi"],
-        capture_output=True, text=True,
-    )
-    return result.returncode == 0
+    driver = health.nvidia_driver()
+    if not driver["ok"]:
+        # No nvidia module (or nouveau bound): nvidia-smi can only fail
+        log(f"nvidia driver not usable: {driver['detail']}")
+        return False
+    try:
+        ok = container.run(["nvidia-smi"], timeout=30, cancel=_cancel).returncode == 0
+    except subprocess.TimeoutExpired:
+        # A hung nvidia-smi is as broken as a failing one
+        ok = False
+    health.record("gpu", {"ok": ok, "detail": "nvidia-smi (setup_thinkpad)"})
+    return ok
 
 
 # ---------------------
@@ -72,35 +226,38 @@ def phase_ostree_upgrade(status):
     status["steps"]["ostree_upgrade"]["status"] = "running"
     save_status(status)
 
-    result = run_cmd(["rpm-ostree", "upgrade"])
-
-    if result.returncode != 0:
-        status["steps"]["ostree_upgrade"]["status"] = "failed"
-        status["steps"]["ostree_upgrade"]["detail"] = (
-            f"rpm-ostree upgrade failed: {result.stderr.strip()}"
-        )
-        save_status(status)
-        return False
-
-    stdout = result.stdout.strip()
-
-    # "Staging deployment...done" = new deployment staged, reboot needed
-    # "No upgrade available." = already up to date
-    upgraded = "staging deployment" in stdout.lower()
+    # The prestage (ostree_upgrade.py --prestage) may already know the answer
+    state = ostree_upgrade.cached_state()
+    if state is None:
+        # Stages from the prestage's download when there is one (--cache-only)
+        result = run_cmd(["ostree_upgrade"], in_pool=True, timeout=3600)
+
+        if result.returncode != 0:
+            status["steps"]["ostree_upgrade"]["status"] = "failed"
+            status["steps"]["ostree_upgrade"]["detail"] = (
+                # ostree_upgrade.py prints rpm-ostree's errors to stdout
+                f"rpm-ostree upgrade failed: {(result.stderr or result.stdout).strip()[-500:]}"
+            )
+            save_status(status)
+            return False
+
+        # ostree_upgrade.py recorded `rpm-ostree status --json` in the cache
+        state = ostree_upgrade.cached_state() or (
+            "staged" if ostree_upgrade.staged_deployment() else "up_to_date")
+    else:
+        log(f"rpm-ostree: {state} (from prestage cache)")
 
-    if upgraded:
+    if state == "staged":
         status["steps"]["ostree_upgrade"]["status"] = "done_needs_reboot"
         status["steps"]["ostree_upgrade"]["detail"] = (
             "Upgrade staged. Reboot required, then run /setup_thinkpad again."
         )
-        status["phase"] = "post_reboot_check"
         save_status(status)
         log("Upgrade staged - reboot needed before continuing")
         return False  # stop here, user must reboot
     else:
         status["steps"]["ostree_upgrade"]["status"] = "skipped"
         status["steps"]["ostree_upgrade"]["detail"] = "Already up to date"
-        status["phase"] = "post_reboot_check"
         save_status(status)
         log("System already up to date, skipping reboot")
         return True  # continue immediately
@@ -117,16 +274,12 @@ def phase_post_reboot_check(status):
     if nvidia_smi_ok():
         status["steps"]["nvidia_fix"]["status"] = "skipped"
         status["steps"]["nvidia_fix"]["detail"] = "nvidia-smi works, no fix needed"
-        status["phase"] = "security_key"
         save_status(status)
         log("nvidia-smi OK, skipping nvidia_fix")
         return True
 
     log("nvidia-smi broken, running nvidia_fix")
-    result = run_cmd([
-        "/var/home/fraser/.cargo/bin/uv", "run",
-        str(BASE_DIR / "nvidia_fix.py"),
-    ])
+    result = run_cmd(["nvidia_fix"], in_pool=True)
 
     if result.returncode != 0:
         status["steps"]["nvidia_fix"]["status"] = "failed"
@@ -140,7 +293,6 @@ def phase_post_reboot_check(status):
     status["steps"]["nvidia_fix"]["detail"] = (
         "Kernel args updated. Reboot required, then run /setup_thinkpad again."
     )
-    status["phase"] = "security_key"
     save_status(status)
     log("nvidia_fix applied - reboot needed before continuing")
     return False  # stop here, user must reboot
@@ -154,10 +306,7 @@ def phase_security_key(status):
     status["steps"]["security_key"]["status"] = "running"
     save_status(status)
 
-    result = run_cmd([
-        "/var/home/fraser/.cargo/bin/uv", "run",
-        str(BASE_DIR / "kleopatra.py"),
-    ])
+    result = run_cmd(["kleopatra"], in_pool=True, timeout=120)
 
     if result.returncode != 0:
         status["steps"]["security_key"]["status"] = "failed"
@@ -169,7 +318,6 @@ def phase_security_key(status):
 
     status["steps"]["security_key"]["status"] = "done"
     status["steps"]["security_key"]["detail"] = "YubiKey initialized"
-    status["phase"] = "vscode_on"
     save_status(status)
     return True
 
@@ -182,10 +330,9 @@ def phase_vscode_on(status):
     status["steps"]["vscode_on"]["status"] = "running"
     save_status(status)
 
-    result = run_cmd([
-        "distrobox", "enter", CONTAINER_NAME,
-        "--", "/var/home/fraser/backup_service/vscode_on.sh",
-    ])
+    result = run_cmd(
+        ["/var/home/fraser/backup_service/vscode_on.sh"], in_container=True,
+    )
 
     if result.returncode != 0:
         status["steps"]["vscode_on"]["status"] = "failed"
@@ -197,7 +344,6 @@ def phase_vscode_on(status):
 
     status["steps"]["vscode_on"]["status"] = "done"
     status["steps"]["vscode_on"]["detail"] = "VS Code + Jupyter started"
-    status["phase"] = "backup"
     save_status(status)
     return True
 
@@ -211,10 +357,9 @@ def phase_backup(status):
     save_status(status)
 
     result = run_cmd([
-        "distrobox", "enter", CONTAINER_NAME,
-        "--", "/var/home/fraser/.cargo/bin/uv", "run",
+        "/var/home/fraser/.cargo/bin/uv", "run",
         "/var/home/fraser/backup_service/backup.py",
-    ])
+    ], in_container=True, timeout=6 * 3600)
 
     if result.returncode != 0:
         status["steps"]["backup"]["status"] = "failed"
@@ -226,7 +371,6 @@ def phase_backup(status):
 
     status["steps"]["backup"]["status"] = "done"
     status["steps"]["backup"]["detail"] = "Backup complete"
-    status["phase"] = "complete"
     save_status(status)
     return True
 
@@ -234,16 +378,51 @@ def phase_backup(status):
 # ---------------------
 # MAIN ORCHESTRATOR
 # ---------------------
+# Phases form a DAG: a phase starts as soon as everything in "after" is done,
+# so independent phases run concurrently. "reboot" phases may end in
+# done_needs_reboot, which is a barrier: nothing new starts, and phases that
+# finished alongside it are reset so they run again after the reboot.
 PHASES = {
-    "ostree_upgrade": phase_ostree_upgrade,
-    "post_reboot_check": phase_post_reboot_check,
-    "security_key": phase_security_key,
-    "vscode_on": phase_vscode_on,
-    "backup": phase_backup,
+    "ostree_upgrade": {
+        "fn": phase_ostree_upgrade, "step": "ostree_upgrade",
+        "after": [], "reboot": True,
+    },
+    "post_reboot_check": {
+        "fn": phase_post_reboot_check, "step": "nvidia_fix",
+        "after": ["ostree_upgrade"], "reboot": True,
+    },
+    "security_key": {
+        "fn": phase_security_key, "step": "security_key",
+        "after": ["ostree_upgrade"], "reboot": False,
+    },
+    "vscode_on": {
+        "fn": phase_vscode_on, "step": "vscode_on",
+        "after": ["post_reboot_check"], "reboot": False,
+    },
+    "backup": {
+        # Not alongside vscode_on's dnf upgrade in the container
+        "fn": phase_backup, "step": "backup",
+        "after": ["vscode_on"], "reboot": False,
+    },
 }
 
+# A done_needs_reboot step counts as satisfied on the next run (after the reboot)
+SATISFIED = ("done", "skipped", "done_needs_reboot")
+
+
+def step_status(status, name):
+    return status["steps"][PHASES[name]["step"]]["status"]
+
+
+def current_phase(status):
+    for name in PHASES:
+        if step_status(status, name) not in SATISFIED:
+            return name
+    return "complete"
+
 
 def run_setup():
+    _cancel.clear()
     status = load_status()
 
     # If a previous run completed, start fresh
@@ -251,16 +430,70 @@ def run_setup():
         status = new_status()
         save_status(status)
 
-    log(f"=== SETUP THINKPAD STARTED (resuming at: {status['phase']}) ===")
+    finished = {n for n in PHASES if step_status(status, n) in SATISFIED}
+    log(f"=== SETUP THINKPAD STARTED (resuming at: {current_phase(status)}) ===")
+
+    blocked = set()
+    completed_now = []
+    running = {}
+    reboot = False
+
+    with ThreadPoolExecutor(max_workers=len(PHASES)) as pool:
+        while True:
+            if not reboot:
+                for name, phase in PHASES.items():
+                    if name in finished or name in blocked or name in running.values():
+                        continue
+                    if any(dep in blocked for dep in phase["after"]):
+                        blocked.add(name)
+                    elif all(dep in finished for dep in phase["after"]):
+                        running[pool.submit(phase["fn"], status)] = name
+                status["phase"] = current_phase(status)
+                save_status(status)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    fut.result()
+                except Cancelled:
+                    step = status["steps"][PHASES[name]["step"]]
+                    step["status"] = "failed"
+                    step["detail"] = "Cancelled"
+                    save_status(status)
+                except Exception as e:
+                    step = status["steps"][PHASES[name]["step"]]
+                    step["status"] = "failed"
+                    step["detail"] = f"{name} crashed: {e}"
+                    save_status(status)
+                state = step_status(status, name)
+                if state in SATISFIED:
+                    finished.add(name)
+                    completed_now.append(name)
+                    reboot = reboot or state == "done_needs_reboot"
+                else:
+                    blocked.add(name)
+
+    if reboot:
+        # Work done before the reboot (e.g. YubiKey warm-up) won't survive it
+        for name in completed_now:
+            if not PHASES[name]["reboot"]:
+                step = status["steps"][PHASES[name]["step"]]
+                step["status"] = "pending"
+                step["detail"] = "Will re-run after reboot"
+
+    status["phase"] = current_phase(status)
+    save_status(status)
 
-    while status["phase"] in PHASES:
-        phase_fn = PHASES[status["phase"]]
-        should_continue = phase_fn(status)
-        if not should_continue:
-            log(f"=== SETUP PAUSED at phase: {status['phase']} ===")
-            return status
+    if status["phase"] != "complete":
+        log(f"=== SETUP PAUSED at phase: {status['phase']} ===")
+        flush_status()
+        return status
 
     log("=== SETUP THINKPAD COMPLETE ===")
+    flush_status()
     return status
 
 
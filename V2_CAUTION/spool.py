@@ -0,0 +1,135 @@
+"""Streaming parser for `zowe jobs submit ... --view-all-spool-content` output.
+
+The COBOL query programs write pipe-delimited rows to the PIPEOUT DD. Rather
+than capturing the whole spool and slicing it with str.find, zowe's stdout is
+read line by line and only rows inside the wanted DD are kept, as tuples.
+"""
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+import metrics
+
+# Seconds for a whole zowe submit + spool read; a hung zowe is killed after this
+TIMEOUT = 300
+
+
+class SpoolError(Exception):
+    pass
+
+
+class Rows:
+    """Query result as a column header plus one tuple per row."""
+
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns, rows=None):
+        self.columns = tuple(columns)
+        self.rows = rows if rows is not None else []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def records(self):
+        """Yield one dict per row (built lazily, for JSON output)."""
+        for row in self.rows:
+            yield dict(zip(self.columns, row))
+
+    def to_json(self):
+        return "[" + ", ".join(json.dumps(r) for r in self.records()) + "]"
+
+
+def iter_spool(lines, dd="PIPEOUT"):
+    """Yield the stripped '|' fields of every row in spool file dd.
+
+    Raises SpoolError if the DD never appears in the output.
+    """
+    found = False
+    in_dd = False
+    for line in lines:
+        head = line.lstrip()
+        if head.startswith("Spool file:"):
+            name = head[len("Spool file:"):].split()
+            in_dd = bool(name) and name[0] == dd
+            found = found or in_dd
+            continue
+        if in_dd and "|" in line:
+            yield tuple(part.strip() for part in line.split("|"))
+    if not found:
+        raise SpoolError(f"{dd} spool not found")
+
+
+def parse(lines, columns, converters=None, dd="PIPEOUT"):
+    """Build Rows from spool lines; rows with fewer fields than columns are skipped."""
+    n = len(columns)
+    converters = converters or (str,) * n
+    rows = Rows(columns)
+    append = rows.rows.append
+    for fields in iter_spool(lines, dd):
+        if len(fields) >= n:
+            append(tuple(conv(f) for conv, f in zip(converters, fields)))
+    return rows
+
+
+def query(jcl, columns, converters=None, dd="PIPEOUT", timeout=None):
+    """Submit a JCL member through zowe and parse its spool as it streams in.
+
+    Raises subprocess.CalledProcessError when zowe exits non-zero and
+    subprocess.TimeoutExpired when it takes longer than timeout (default TIMEOUT).
+    """
+    if timeout is None:
+        timeout = TIMEOUT
+    cmd = ["zowe", "jobs", "submit", "ds", jcl, "--view-all-spool-content"]
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        rows = _submit(cmd, columns, converters, dd, timeout)
+        outcome = "ok"
+        return rows
+    finally:
+        metrics.QUERY_SECONDS.observe((jcl, outcome), time.monotonic() - started)
+
+
+def _kill(p, killed):
+    killed.set()
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _submit(cmd, columns, converters, dd, timeout):
+    # stderr goes to a file so a chatty zowe can't block on a full pipe
+    with tempfile.TemporaryFile(mode="w+") as err:
+        # Own session: zowe is node and may have children of its own
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, text=True,
+                             start_new_session=True)
+        # parse() blocks on zowe's stdout, so the deadline is enforced by killing it
+        killed = threading.Event()
+        timer = threading.Timer(timeout, _kill, (p, killed))
+        timer.start()
+        spool_error = None
+        try:
+            rows = parse(p.stdout, columns, converters, dd)
+        except SpoolError as e:
+            spool_error = e
+        finally:
+            p.stdout.close()
+            returncode = p.wait()
+            timer.cancel()
+        if killed.is_set() and returncode < 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        # A failed submit usually also lacks the DD; report the zowe error first
+        if returncode != 0:
+            err.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=err.read())
+        if spool_error:
+            raise spool_error
+    return rows
@@ -0,0 +1,93 @@
+"""Fast-start helpers: lazy task modules and time-to-first-response.
+
+Times are measured from the moment the process was exec'd (read from /proc),
+so interpreter start-up and imports are included. With socket activation
+(backup_service.socket) a trigger that arrives during boot waits in the
+listen backlog and is answered as soon as the app is ready.
+"""
+import importlib
+import os
+import threading
+import time
+
+import metrics
+
+# stage -> seconds since exec: "imported", "ready", "warm", "first_response"
+STAGES = {}
+
+
+def process_start_time():
+    """Wall-clock time this process was exec'd."""
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after "(comm)"; starttime is field 22 of the full line
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(fields[19])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_START = process_start_time()
+
+
+def mark(stage):
+    if stage not in STAGES:
+        STAGES[stage] = round(time.time() - PROCESS_START, 3)
+        print(f"startup: {stage} after {STAGES[stage]}s", flush=True)
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def preload(*modules):
+    """Import lazy modules in a background thread once the app is serving."""
+    def load():
+        for m in modules:
+            try:
+                m._load()
+            except Exception as e:
+                print(f"startup: preload of {m._name} failed: {e}", flush=True)
+        mark("warm")
+    threading.Thread(target=load, name="preload", daemon=True).start()
+
+
+class FirstResponseTimer:
+    """ASGI middleware that records when the first response starts, then gets out of the way."""
+
+    def __init__(self, app):
+        self.app = app
+        self.seen = False
+
+    async def __call__(self, scope, receive, send):
+        if self.seen or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start" and not self.seen:
+                self.seen = True
+                mark("first_response")
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+@metrics.collector
+def _startup_gauges():
+    return [("backup_service_startup_seconds", "Seconds from process exec to each start-up stage",
+             "gauge", ("stage",), {(stage,): v for stage, v in STAGES.items()})]
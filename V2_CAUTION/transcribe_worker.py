@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# Warm worker for Cohere transcription (batch_transcribe.py).
+#
+#   transcribe_worker.py serve            long-lived; imports torch and loads the model once
+#   transcribe_worker.py [submit] [FILE]  what /cohere_transcription runs: starts the worker
+#                                         if needed, sends one batch and prints its progress
+#
+# Protocol on SOCKET_PATH, one JSON object per line:
+#   client -> worker  {"files": [...] | null}   or   {"ping": true}   or   {"release": true}
+#   worker -> client  {"start": {...}}, {"file": ...}* per file, {"output": "..."}*, {"done": {...}}
+# Batches queue up and run one at a time on the GPU thread. After IDLE_RELEASE
+# seconds without work the model is dropped and CUDA memory returned; the
+# interpreter (torch, transformers already imported) stays up for the next batch.
+# "release" drops it right away (queued behind any batch), so OCR can have the VRAM.
+# A client that hangs up (its job was cancelled or timed out) cancels its batch:
+# the file being transcribed finishes, the rest are skipped.
+#
+# The worker runs in batch_transcribe.py's own environment (see worker_command()),
+# not this service's, since torch and transformers live there.
+#
+# batch_transcribe.py is used through optional hooks:
+#   load_model() -> model
+#   transcribe_file(model, path) -> text (written to <audio>.txt) or None (it saved it itself)
+#   pending_files() -> paths to transcribe when the trigger names none
+# Without load_model/transcribe_file its main() is run in-process instead: imports
+# stay warm but the model is loaded by main() each time, and a cancel only takes
+# effect once main() returns.
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import wave
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path("/var/home/fraser/backup_service")
+UV = "/var/home/fraser/.cargo/bin/uv"
+COHERE_SCRIPT = Path("/var/home/fraser/machine_learning/cohere_transcribe/batch_transcribe.py")
+SOCKET_PATH = BASE_DIR / "transcribe_worker.sock"
+WORKER_LOG = BASE_DIR / "transcribe_worker.log"
+
+IDLE_RELEASE = 600
+IDLE_CHECK = 10
+# How often a connection waiting on its batch checks that the client is still there
+DISCONNECT_CHECK = 1.0
+# A queued batch marker asking the GPU thread to drop the model now
+RELEASE = object()
+# torch + transformers import on a cold start
+START_TIMEOUT = 180
+
+
+def log(msg):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{timestamp} {msg}", flush=True)
+
+
+def write_atomic(path, text):
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def audio_seconds(path):
+    """Duration for the real-time factor; None if no audio library can tell."""
+    try:
+        import soundfile
+        return soundfile.info(str(path)).duration
+    except Exception:
+        pass
+    try:
+        import librosa
+        return librosa.get_duration(path=str(path))
+    except Exception:
+        pass
+    try:
+        with wave.open(str(path)) as w:
+            return w.getnframes() / w.getframerate()
+    except Exception:
+        return None
+
+
+# -----------------------------
+# WORKER (serve)
+# -----------------------------
+class Backend:
+    """batch_transcribe.py imported once; reloaded if the file changes."""
+
+    def __init__(self, script=None):
+        self.script = script or COHERE_SCRIPT
+        self.module = None
+        self.mtime = None
+        self.model = None
+
+    def _import(self):
+        mtime = self.script.stat().st_mtime_ns
+        if self.module is not None and mtime == self.mtime:
+            return
+        sys.path.insert(0, str(self.script.parent))
+        spec = importlib.util.spec_from_file_location("batch_transcribe", self.script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if self.module is not None:
+            log("batch_transcribe.py changed, reloaded")
+            self.release()
+        self.module, self.mtime = module, mtime
+
+    @property
+    def has_hooks(self):
+        return all(hasattr(self.module, h) for h in ("load_model", "transcribe_file"))
+
+    def load(self):
+        """Import the script and load the model if needed; returns seconds spent."""
+        t0 = time.monotonic()
+        self._import()
+        if self.has_hooks and self.model is None:
+            self.model = self.module.load_model()
+            log(f"Model loaded in {time.monotonic() - t0:.1f}s")
+        return round(time.monotonic() - t0, 2)
+
+    def pending(self):
+        if hasattr(self.module, "pending_files"):
+            return [Path(p) for p in self.module.pending_files()]
+        return []
+
+    def transcribe(self, path):
+        text = self.module.transcribe_file(self.model, str(path))
+        if isinstance(text, str):
+            write_atomic(path.with_suffix(".txt"), text)
+
+    def release(self, why="idle"):
+        """Drop the model and return CUDA memory; True if one was loaded."""
+        if self.model is None:
+            return False
+        self.model = None
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log(f"Model released ({why})")
+        return True
+
+
+class _BatchStdout(io.TextIOBase):
+    """sys.stdout for the worker: the GPU thread's prints during capture() go to its
+    client as output frames, everything else (log() from other threads) to the log."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def capture(self, out):
+        self.local.out = out
+        try:
+            yield
+        finally:
+            self.local.out = None
+
+    def write(self, s):
+        out = getattr(self.local, "out", None)
+        if out is None:
+            return self.default.write(s)
+        if s:
+            out.put({"output": s})
+        return len(s)
+
+    def flush(self):
+        if getattr(self.local, "out", None) is None:
+            self.default.flush()
+
+
+class Worker:
+    def __init__(self, backend):
+        self.backend = backend
+        self.batches = queue.Queue()
+        self.last_used = time.monotonic()
+        self.busy = False
+
+    def run_forever(self):
+        while True:
+            try:
+                files, out, cancel = self.batches.get(timeout=IDLE_CHECK)
+            except queue.Empty:
+                if time.monotonic() - self.last_used > IDLE_RELEASE:
+                    self.backend.release()
+                continue
+            if files is RELEASE:
+                out.put({"done": {"ok": True, "released": self.backend.release("requested")}})
+                continue
+            if cancel.is_set():
+                out.put({"done": {"ok": False, "cancelled": True, "files": 0}})
+                continue
+            self.busy = True
+            try:
+                out.put({"done": self.run_batch(files, out, cancel)})
+            except Exception as e:
+                log(f"Batch failed: {type(e).__name__}: {e}")
+                out.put({"done": {"ok": False, "error": f"{type(e).__name__}: {e}"}})
+            finally:
+                self.busy = False
+                self.last_used = time.monotonic()
+
+    def run_batch(self, files, out, cancel):
+        t0 = time.monotonic()
+        load_s = self.backend.load()
+        if not self.backend.has_hooks:
+            out.put({"start": {"files": None, "load_s": load_s, "mode": "main()"}})
+            argv, sys.argv = sys.argv, [str(self.backend.script)]
+            try:
+                with sys.stdout.capture(out):
+                    rc = self.backend.module.main()
+            except SystemExit as e:
+                # sys.exit()/argparse in main() ends the batch, not the worker
+                rc = e.code
+            finally:
+                sys.argv = argv
+            return {"ok": rc in (None, 0, True), "exit": rc, "seconds": round(time.monotonic() - t0, 2)}
+
+        paths = [Path(f) for f in files] if files else self.backend.pending()
+        out.put({"start": {"files": len(paths), "load_s": load_s, "mode": "warm"}})
+        total_audio = total_time = 0.0
+        errors = done = 0
+        for i, path in enumerate(paths, 1):
+            if cancel.is_set():
+                log(f"Batch cancelled by the client after {done}/{len(paths)} files")
+                break
+            f0 = time.monotonic()
+            frame = {"file": path.name, "index": i, "total": len(paths)}
+            try:
+                self.backend.transcribe(path)
+                frame["ok"] = True
+            except Exception as e:
+                frame.update(ok=False, error=f"{type(e).__name__}: {e}")
+                errors += 1
+            elapsed = time.monotonic() - f0
+            audio = audio_seconds(path)
+            frame["elapsed_s"] = round(elapsed, 2)
+            frame["audio_s"] = round(audio, 1) if audio else None
+            frame["rtf"] = round(elapsed / audio, 3) if audio else None
+            if audio and frame["ok"]:
+                total_audio += audio
+                total_time += elapsed
+            done += 1
+            out.put(frame)
+        return {
+            "ok": errors == 0 and not cancel.is_set(),
+            "cancelled": cancel.is_set(),
+            "files": done,
+            "errors": errors,
+            "load_s": load_s,
+            "seconds": round(time.monotonic() - t0, 2),
+            "rtf": round(total_time / total_audio, 3) if total_audio else None,
+        }
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def send(self, obj):
+        """False if the client went away."""
+        try:
+            self.wfile.write(json.dumps(obj).encode() + b"\n")
+            self.wfile.flush()
+        except OSError:
+            return False
+        return True
+
+    def gone(self):
+        """True once the client hung up; it sends nothing after its request line."""
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def handle(self):
+        worker = self.server.worker
+        try:
+            req = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            return
+        if req.get("ping"):
+            self.send({
+                "pong": os.getpid(),
+                "model_loaded": worker.backend.model is not None,
+                "busy": worker.busy,
+                "queued": worker.batches.qsize(),
+                "idle_s": round(time.monotonic() - worker.last_used),
+            })
+            return
+        out = queue.Queue()
+        cancel = threading.Event()
+        worker.batches.put((RELEASE if req.get("release") else req.get("files"), out, cancel))
+        while True:
+            try:
+                frame = out.get(timeout=DISCONNECT_CHECK)
+            except queue.Empty:
+                frame = None
+            if frame is None and not self.gone():
+                continue
+            if frame is None or not self.send(frame):
+                # The submit client was killed (job cancelled or timed out): stop the
+                # batch so it doesn't keep the GPU after the job gave up its claim
+                cancel.set()
+                return
+            if "done" in frame:
+                return
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve():
+    if ping():
+        log("another worker is already listening, exiting")
+        return
+    SOCKET_PATH.unlink(missing_ok=True)
+    sys.stdout = _BatchStdout(sys.stdout)
+    worker = Worker(Backend())
+    server = Server(str(SOCKET_PATH), Handler)
+    os.chmod(SOCKET_PATH, 0o600)
+    server.worker = worker
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log(f"listening on {SOCKET_PATH} (pid {os.getpid()})")
+    # Import torch/transformers and load the model before the first batch arrives
+    try:
+        worker.backend.load()
+    except Exception as e:
+        log(f"Preload failed: {type(e).__name__}: {e}")
+    worker.run_forever()
+
+
+# -----------------------------
+# CLIENT (submit)
+# -----------------------------
+def ping(timeout=1.0):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+        s.sendall(b'{"ping": true}\n')
+        return json.loads(s.makefile("rb").readline() or b"null")
+    except (OSError, ValueError):
+        return None
+    finally:
+        s.close()
+
+
+def release(timeout=60):
+    """Ask a running worker to drop its model now; True if it had one loaded."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(str(SOCKET_PATH))
+    except OSError:
+        # No worker, nothing resident
+        s.close()
+        return False
+    try:
+        s.sendall(b'{"release": true}\n')
+        frame = json.loads(s.makefile("rb").readline() or b"{}")
+        return frame.get("done", {}).get("released", False)
+    finally:
+        s.close()
+
+
+def worker_command():
+    """`transcribe_worker.py serve` in the environment `uv run batch_transcribe.py` would use."""
+    me = str(Path(__file__).resolve())
+    try:
+        inline = "# /// script" in COHERE_SCRIPT.read_text()
+    except OSError:
+        inline = False
+    if inline:
+        # PEP 723 dependencies in the script itself
+        return [UV, "run", "--no-project", "--with-requirements", str(COHERE_SCRIPT), me, "serve"]
+    project = COHERE_SCRIPT.parent
+    if (project / "pyproject.toml").exists():
+        return [UV, "run", "--project", str(project), me, "serve"]
+    venv = project / ".venv" / "bin" / "python"
+    if venv.exists():
+        return [str(venv), me, "serve"]
+    # torch installed alongside this service (see the readme)
+    return [UV, "run", me, "serve"]
+
+
+def ensure_worker():
+    if ping():
+        return True
+    print("[transcribe] starting worker (first run loads torch and the model)", flush=True)
+    with WORKER_LOG.open("a") as wlog:
+        subprocess.Popen(
+            worker_command(),
+            cwd=BASE_DIR,
+            stdin=subprocess.DEVNULL,
+            stdout=wlog,
+            stderr=wlog,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if ping():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def submit(files=None):
+    t0 = time.monotonic()
+    if not ensure_worker():
+        print(f"[transcribe] ERROR: worker did not start, see {WORKER_LOG}", flush=True)
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(str(SOCKET_PATH))
+    s.sendall(json.dumps({"files": [str(Path(f).resolve()) for f in files] if files else None}).encode() + b"\n")
+    done = {"ok": False, "error": "worker closed the connection"}
+    for line in s.makefile("rb"):
+        frame = json.loads(line)
+        if "start" in frame:
+            st = frame["start"]
+            print(f"[transcribe] batch started after {time.monotonic() - t0:.2f}s "
+                  f"(model ready in {st['load_s']}s, files: {st['files']}, mode: {st['mode']})", flush=True)
+        elif "file" in frame:
+            status = "ok" if frame["ok"] else f"ERROR {frame['error']}"
+            rtf = f", RTF {frame['rtf']}" if frame["rtf"] is not None else ""
+            audio = f"{frame['audio_s']}s audio in " if frame["audio_s"] else ""
+            print(f"[transcribe] [{frame['index']}/{frame['total']}] {frame['file']}: "
+                  f"{audio}{frame['elapsed_s']}s{rtf} {status}", flush=True)
+        elif "output" in frame:
+            sys.stdout.write(frame["output"])
+            sys.stdout.flush()
+        elif "done" in frame:
+            done = frame["done"]
+            break
+    s.close()
+    print(f"[transcribe] done: {json.dumps(done)}", flush=True)
+    return done.get("ok", False)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["serve"]:
+        serve()
+    else:
+        if args[:1] == ["submit"]:
+            args = args[1:]
+        sys.exit(0 if submit(args) else 1)
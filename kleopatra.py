@@ -1,9 +1,30 @@
+import json
+import socket
 import subprocess
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
 STATUS_FILE = Path("/var/home/fraser/backup_service/kleopatra_status.txt")
 BASE_DIR = Path("/var/home/fraser/backup_service")
+# One line per warm-up (boot id, uptime, per-step seconds) to compare across reboots
+TIMINGS_FILE = BASE_DIR / "kleopatra_timings.jsonl"
+
+# Also used by the V2 service's GET /health (health.py), so stdlib only here
+PCSCD_SOCKET = Path("/run/pcscd/pcscd.comm")
+USB_DEVICES = Path("/sys/bus/usb/devices")
+YUBICO_VENDOR = "1050"
+
+# Readiness polling: first retry after BACKOFF_START seconds, doubling up to
+# BACKOFF_MAX, until the step's deadline
+BACKOFF_START = 0.05
+BACKOFF_MAX = 1.0
+PCSCD_DEADLINE = 10
+CARD_DEADLINE = 20
+# A single gpg --card-status against a wedged pcscd must not hang the warm-up
+CARD_STATUS_TIMEOUT = 5
 
 def run(cmd, **kwargs):
     print(f"Running: {' '.join(cmd)}")
@@ -15,35 +36,135 @@ def run(cmd, **kwargs):
         print(f"✗ Failed with exit code {e.returncode}")
         return False
 
-def main():
-    ok = True
-
-    # 0. Reset all GnuPG daemons (scdaemon, gpg-agent, etc.)
-    ok &= run(["gpgconf", "--kill", "all"])
+def timed(timings, step, fn, *args, **kwargs):
+    t0 = time.monotonic()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[step] = round(time.monotonic() - t0, 3)
 
-    # 1. Restart pcscd (polkit rule allows this without sudo)
-    ok &= run(["systemctl", "restart", "pcscd"])
+def wait_for(what, check, deadline):
+    """Poll check() with exponential backoff until it passes or deadline seconds elapse."""
+    t0 = time.monotonic()
+    delay = BACKOFF_START
+    attempts = 0
+    while True:
+        attempts += 1
+        if check():
+            print(f"✓ {what} ready after {time.monotonic() - t0:.2f}s ({attempts} checks)")
+            return True
+        remaining = deadline - (time.monotonic() - t0)
+        if remaining <= 0:
+            print(f"✗ {what} not ready after {deadline}s ({attempts} checks)")
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, BACKOFF_MAX)
 
-    # 2. Give pcscd a moment to rebind to the YubiKey
-    time.sleep(1)
+# -----------------------------
+# READINESS CHECKS
+# -----------------------------
+def pcscd_accepting():
+    """pcscd (or its activation socket) accepts connections. Connecting starts a
+    socket-activated pcscd, so GET /health doesn't use it as a probe."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(str(PCSCD_SOCKET))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
 
-    # 3. Force YubiKey detection
-    ok &= run(["gpg", "--card-status"])
+def yubikey_device():
+    """Product name of the first Yubico USB device, or None."""
+    for dev in USB_DEVICES.glob("*/idVendor"):
+        try:
+            if dev.read_text().strip() != YUBICO_VENDOR:
+                continue
+            product = dev.with_name("product")
+            return product.read_text().strip() if product.exists() else "Yubico device"
+        except OSError:
+            continue
+    return None
 
-    # 4. Optional signing test
-    ok &= run([
-        "gpg", "--batch", "--yes",
-        "--clearsign"
-    ], input=b"test")
+def card_ready():
+    """The YubiKey is on the bus and answers gpg --card-status."""
+    if yubikey_device() is None:
+        return False
+    try:
+        result = subprocess.run(["gpg", "--card-status"], capture_output=True,
+                                timeout=CARD_STATUS_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return False
+    return result.returncode == 0
 
-    # 5. NVIDIA check (optional)
+def nvidia_check():
     nvidia_script = BASE_DIR / "nvidia-check.sh"
-    if nvidia_script.exists():
-        ok &= run([str(nvidia_script)])
-    else:
+    if not nvidia_script.exists():
         print("Skipping NVIDIA check (script not found)")
+        return True
+    # Runs alongside the card steps; output is printed as one block when it's done
+    result = subprocess.run([str(nvidia_script)], capture_output=True, text=True)
+    print(f"NVIDIA check (exit {result.returncode}):\n{result.stdout}{result.stderr}".rstrip())
+    return result.returncode == 0
+
+# -----------------------------
+# WARM-UP
+# -----------------------------
+def warm_up():
+    """Reset GnuPG and pcscd, wait for the card, test signing. Returns (ok, timings)."""
+    timings = {}
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        # Unrelated to the card, so it overlaps with everything below
+        nvidia = pool.submit(timed, timings, "nvidia_check", nvidia_check)
+
+        # 0. Reset all GnuPG daemons (scdaemon, gpg-agent, etc.) and
+        # 1. restart pcscd (polkit rule allows this without sudo), side by side
+        kill = pool.submit(timed, timings, "gpgconf_kill", run, ["gpgconf", "--kill", "all"])
+        restart = pool.submit(timed, timings, "pcscd_restart", run, ["systemctl", "restart", "pcscd"])
+        ok = kill.result()
+        ok &= restart.result()
+
+        # 2. Wait until pcscd is back and has rebound the YubiKey
+        ok &= timed(timings, "pcscd_wait", wait_for, "pcscd", pcscd_accepting, PCSCD_DEADLINE)
+        card = timed(timings, "card_wait", wait_for, "YubiKey", card_ready, CARD_DEADLINE)
+        ok &= card
 
+        if card:
+            # 3. Show the card (now that it answers) and 4. signing test
+            ok &= timed(timings, "card_status", run, ["gpg", "--card-status"])
+            ok &= timed(timings, "clearsign", run, [
+                "gpg", "--batch", "--yes",
+                "--clearsign"
+            ], input=b"test")
+        else:
+            print("Skipping signing test (card not ready)")
+
+        ok &= nvidia.result()
+    timings["total"] = round(time.monotonic() - t0, 3)
+    report(ok, timings)
+    return ok, timings
+
+def report(ok, timings):
+    print("Warm-up timings:")
+    for step, seconds in timings.items():
+        print(f"  {step:<15}{seconds:>8.3f}s")
+    try:
+        boot_id = Path("/proc/sys/kernel/random/boot_id").read_text().strip()
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+        with TIMINGS_FILE.open("a") as f:
+            f.write(json.dumps({
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "boot_id": boot_id, "uptime_s": round(uptime), "ok": bool(ok), "timings": timings,
+            }) + "\n")
+    except OSError as e:
+        print(f"Could not save timings: {e}")
+
+def main():
+    ok, _ = warm_up()
     print("Kleopatra warm-up complete. YubiKey should now be ready. Check kleopatra.log.")
+    return ok
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)